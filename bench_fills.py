@@ -0,0 +1,239 @@
+import argparse
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from hashkey_ledger import LEDGER_COLUMNS, MATCHED, ORPHANED
+
+# Replays executionReport streams through WebSocketClient._on_message with REST stubbed out and
+# the ledger in a scratch directory, and reports throughput, handling latency and memory as the
+# ledger history grows. Compares the sqlite ledger with the previous pandas/CSV bookkeeping.
+# recv is the cost of _on_message on the event loop, handle the time in the fill handler and
+# fill the time from receipt to handled, which includes queueing behind earlier fills.
+#
+#   python bench_fills.py --sizes 1000 10000 100000 1000000 --messages 2000
+#   python bench_fills.py --backend csv --sizes 1000 10000 --messages 200
+#   python bench_fills.py --replay recorded_frames.jsonl --sizes 100000
+#
+# A replay file holds one raw private stream frame per line, as received on the websocket.
+
+BENCH_CONFIG = """[DEFAULT]
+access = bench
+secret = bench
+trade_pairs = {pairs}
+dca_pairs = {first_pair}
+trade_interval_s = 60
+dca_hour = 0
+dca_minute = 0
+
+{sections}
+"""
+PAIR_SECTION = """[{pair}]
+buy_limit_margin = 0.99
+sell_limit_margin = 1.01
+trade_quantity = 0.001
+dca_amount = 10
+"""
+
+
+class LegacyCsvLedger:
+    # the pandas/CSV bookkeeping _on_message used before the sqlite ledger, behind the ledger
+    # interface: concat + full to_csv on every fill, a cast-and-scan of Buy_ID to match sells
+    def __init__(self, csv_path):
+        import pandas as pd
+        self._pd = pd
+        self.csv_path = csv_path
+        # read as str, current pandas refuses the string fill values into inferred float columns
+        self.trades_df = pd.read_csv(csv_path, dtype=str)
+        self.stats = {'orphaned_sells': 0, 'duplicate_buy_ids': 0, 'duplicate_sells': 0, 'replayed_duplicates': 0}
+        # the fill workers share the frame, the old single-threaded path needed no lock
+        self._lock = threading.Lock()
+
+    def is_duplicate_buy(self, buy_id, replayed=False):
+        return False
+
+    def log_buy(self, trade):
+        with self._lock:
+            return self._log_buy(trade)
+
+    def _log_buy(self, trade):
+        self.trades_df = self._pd.concat([self.trades_df, self._pd.DataFrame([trade])], ignore_index=True)
+        self.trades_df.to_csv(self.csv_path, index=False)
+        return len(self.trades_df) - 1
+
+    def log_sell(self, buy_id, trade, replayed=False):
+        with self._lock:
+            return self._log_sell(buy_id, trade)
+
+    def _log_sell(self, buy_id, trade):
+        search_trade = self.trades_df[self.trades_df['Buy_ID'].astype(str) == str(buy_id)]
+        if search_trade.empty:
+            self.trades_df = self._pd.concat([self.trades_df, self._pd.DataFrame([trade])], ignore_index=True)
+            status = ORPHANED
+        else:
+            self.trades_df.loc[search_trade.index[0], list(trade)] = list(trade.values())
+            status = MATCHED
+        self.trades_df.to_csv(self.csv_path, index=False)
+        return status
+
+
+def write_history(csv_path, size, symbols):
+    # size round trips, every other one still open
+    with open(csv_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(LEDGER_COLUMNS)
+        for i in range(size):
+            buy = ['Market Maker', symbols[i % len(symbols)], '2024-01-01 00:00:00', str(10 ** 12 + i),
+                   0.001, 60000, 0.00001, 60]
+            sell = ['2024-01-02 00:00:00', str(10 ** 12 + i), 0.001, 60600, 0.06, 60.6, ''] \
+                if i % 2 else [''] * 7
+            writer.writerow(buy + sell)
+
+
+def synthetic_frames(messages, symbols, first_id):
+    # a NEW and a FILLED report per order, fills alternate between a new buy and the sell of
+    # the previous buy, as the market maker produces them
+    frames = []
+    now = int(time.time() * 1000)
+    for i in range(messages):
+        order_id = str(first_id + i - i % 2)
+        side = 'BUY' if i % 2 == 0 else 'SELL'
+        report = {'e': 'executionReport', 'E': now + i, 's': symbols[(i // 2) % len(symbols)], 'S': side,
+                  'o': 'LIMIT', 'q': '0.001', 'p': '60000', 'n': '0.00001', 'Z': '60',
+                  'i': order_id if side == 'BUY' else str(first_id + 10 ** 9 + i), 'c': order_id}
+        frames.append(json.dumps([dict(report, X='NEW')]))
+        frames.append(json.dumps([dict(report, X='FILLED')]))
+    return frames
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else float('nan')
+
+
+def run_case(backend, size, messages, symbols, replay, workdir):
+    logging.basicConfig(level=logging.ERROR)
+    os.chdir(workdir)
+    os.makedirs('config', exist_ok=True)
+    os.makedirs('reports', exist_ok=True)
+    with open('config/config_hashkey.cfg', 'w') as f:
+        f.write(BENCH_CONFIG.format(pairs=','.join(symbols), first_pair=symbols[0],
+                                    sections='\n'.join(PAIR_SECTION.format(pair=pair) for pair in symbols)))
+    history_csv = os.path.join(workdir, 'history.csv')
+    write_history(history_csv, size, symbols)
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import hashkey_bot
+    from hashkey_config import load_config
+    from hashkey_ledger import TradeLedger
+    from hashkey_pipeline import FillPipeline
+
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    if backend == 'csv':
+        ledger = LegacyCsvLedger(history_csv)
+    else:
+        ledger = TradeLedger(os.path.join(workdir, 'bench.db'), csv_path=history_csv)
+    load_s = time.perf_counter() - start
+
+    client = hashkey_bot.WebSocketClient(load_config('config/config_hashkey.cfg'), ledger)
+    # REST stubbed: follow-up sells are acknowledged immediately
+    client.create_new_order = lambda params: {'orderId': params.get('newClientOrderId')}
+
+    received = {}
+    handled = []  # receive -> handled, includes time queued
+    service = []  # time spent in the fill handler itself
+
+    def timed_handle_fill(order):
+        t0 = time.perf_counter()
+        client._handle_fill(order)
+        done = time.perf_counter()
+        service.append(done - t0)
+        handled.append(done - received[order['i']])
+
+    client._pipeline = FillPipeline(timed_handle_fill, client._submit_order, maxsize=100000)
+    client._pipeline.start()
+
+    frames = open(replay).read().splitlines() if replay else synthetic_frames(messages, symbols, 10 ** 13)
+    receive = []
+    start = time.perf_counter()
+    for frame in frames:
+        t0 = time.perf_counter()
+        for report in json.loads(frame) if frame.startswith('[') else []:
+            received[report.get('i')] = t0
+        for order in client._on_message(None, frame):
+            # the bot waits for room off the event loop, here the replay thread just blocks
+            client._pipeline.submit_fill(order)
+        receive.append(time.perf_counter() - t0)
+    client._pipeline.join()
+    elapsed = time.perf_counter() - start
+    client._pipeline.stop()
+
+    return {
+        'backend': backend,
+        'history': size,
+        'frames': len(frames),
+        'fills': len(handled),
+        'load_s': load_s,
+        'msgs_per_s': len(frames) / elapsed,
+        'fills_per_s': len(handled) / elapsed,
+        'recv_p50_us': percentile(receive, 0.5) * 1e6,
+        'recv_p99_us': percentile(receive, 0.99) * 1e6,
+        'fill_p50_ms': percentile(handled, 0.5) * 1e3,
+        'fill_p99_ms': percentile(handled, 0.99) * 1e3,
+        'handle_p50_us': percentile(service, 0.5) * 1e6,
+        'handle_p99_us': percentile(service, 0.99) * 1e6,
+        'rss_mb': rss_mb(),
+        'rss_growth_mb': rss_mb() - rss_before,
+    }
+
+
+def run_isolated(args):
+    # one fresh process per case so memory figures and module state do not carry over
+    with tempfile.TemporaryDirectory() as workdir:
+        with multiprocessing.get_context('spawn').Pool(1) as pool:
+            return pool.apply(run_case, (*args, workdir))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fill handling replay benchmark for WebSocketClient._on_message')
+    parser.add_argument('--backend', choices=['sqlite', 'csv', 'both'], default='sqlite',
+                        help='sqlite ledger, the previous pandas/CSV path, or both')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000],
+                        help='ledger history sizes (round trips) to replay against')
+    parser.add_argument('--messages', type=int, default=2000, help='synthetic frames per run')
+    parser.add_argument('--symbols', default='BTCUSD,ETHUSD', help='comma separated symbols')
+    parser.add_argument('--replay', help='file with one recorded private stream frame per line')
+    args = parser.parse_args()
+
+    backends = ['sqlite', 'csv'] if args.backend == 'both' else [args.backend]
+    header = (f"{'backend':<8}{'history':>10}{'fills':>8}{'load s':>9}{'msg/s':>10}{'recv p50 us':>13}"
+              f"{'recv p99 us':>13}{'handle p50 us':>15}{'handle p99 us':>15}{'fill p50 ms':>13}{'fill p99 ms':>13}"
+              f"{'rss MB':>9}{'growth MB':>11}")
+    print(header)
+    for backend in backends:
+        for size in args.sizes:
+            r = run_isolated((backend, size, args.messages, args.symbols.split(','), args.replay))
+            print(f"{r['backend']:<8}{r['history']:>10}{r['fills']:>8}{r['load_s']:>9.2f}{r['msgs_per_s']:>10.0f}"
+                  f"{r['recv_p50_us']:>13.1f}{r['recv_p99_us']:>13.1f}{r['handle_p50_us']:>15.1f}"
+                  f"{r['handle_p99_us']:>15.1f}{r['fill_p50_ms']:>13.2f}"
+                  f"{r['fill_p99_ms']:>13.2f}{r['rss_mb']:>9.1f}{r['rss_growth_mb']:>11.1f}", flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import argparse
+import base64
+import hashlib
+import hmac
+import os
+import time
+import urllib.parse
+
+from signing import HashKeySigner, KrakenSigner
+
+# Signing throughput for bursts of order requests, per-call key setup (the previous
+# implementations, kept here as the baseline) against the per-credential signers.
+#
+#   python bench_signing.py --burst 5000 --rounds 5
+
+
+def legacy_hashkey_signature(secret_key, params, data=""):
+    for k, v in params.items():
+        data = data + str(k) + "=" + str(v) + "&"
+    return hmac.new(secret_key.encode(), data[:-1].encode(), digestmod=hashlib.sha256).hexdigest()
+
+
+def legacy_hashkey_body(secret_key, params):
+    # the old path signed the raw concatenation, then requests url-encoded the dict as the body
+    return urllib.parse.urlencode(dict(params, signature=legacy_hashkey_signature(secret_key, params)))
+
+
+def legacy_kraken_signature(urlpath, data, secret):
+    postdata = urllib.parse.urlencode(data)
+    encoded = (str(data['nonce']) + postdata).encode()
+    message = urlpath.encode() + hashlib.sha256(encoded).digest()
+    mac = hmac.new(base64.b64decode(secret), message, hashlib.sha512)
+    return base64.b64encode(mac.digest()).decode()
+
+
+def order_params(i):
+    return {
+        "symbol": 'BTCUSD',
+        "price": 60000 + i % 100,
+        "side": 'BUY',
+        "type": 'LIMIT',
+        "quantity": '0.001',
+        'timestamp': 1700000000000 + i,
+    }
+
+
+def run(label, func, burst, rounds):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for i in range(burst):
+            func(i)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{label:<28} {burst / best:>12,.0f} signs/s  ({best * 1e6 / burst:.2f} us/sign, best of {rounds})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HMAC request signing micro-benchmark')
+    parser.add_argument('--burst', type=int, default=5000, help='requests signed per round')
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    hashkey_secret = os.urandom(32).hex()
+    kraken_secret = base64.b64encode(os.urandom(64)).decode()
+    hashkey_signer = HashKeySigner(hashkey_secret)
+    kraken_signer = KrakenSigner(kraken_secret)
+    kraken_data = [{'nonce': str(1700000000000 + i), 'ordertype': 'limit', 'pair': 'XBTUSD',
+                    'price': str(60000 + i % 100), 'type': 'buy', 'volume': '0.001'} for i in range(args.burst)]
+    orders = [order_params(i) for i in range(args.burst)]
+
+    # both paths must produce the same body for plain order payloads
+    assert hashkey_signer.signed_payload(orders[0]) == legacy_hashkey_body(hashkey_secret, orders[0])
+    assert kraken_signer.sign('/0/private/AddOrder', kraken_data[0])[1] == \
+        legacy_kraken_signature('/0/private/AddOrder', kraken_data[0], kraken_secret)
+
+    run('hashkey legacy', lambda i: legacy_hashkey_body(hashkey_secret, orders[i]), args.burst, args.rounds)
+    run('hashkey signer', lambda i: hashkey_signer.signed_payload(orders[i]), args.burst, args.rounds)
+    run('kraken legacy', lambda i: legacy_kraken_signature('/0/private/AddOrder', kraken_data[i], kraken_secret),
+        args.burst, args.rounds)
+    run('kraken signer', lambda i: kraken_signer.sign('/0/private/AddOrder', kraken_data[i]), args.burst, args.rounds)
+
+
+if __name__ == '__main__':
+    main()
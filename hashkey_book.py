@@ -0,0 +1,69 @@
+import threading
+import time
+
+
+def _version(v):
+    # depth versions look like '1447927_18', the leading counter orders the updates
+    try:
+        return int(str(v).split('_')[0])
+    except (TypeError, ValueError):
+        return None
+
+
+class BookCache:
+    # Top of book per symbol, fed by the public depth stream with REST bookTicker snapshots as
+    # the fallback. Updates older than what is cached (by exchange time, then depth version)
+    # are dropped, and a quote not refreshed within max_age_s is treated as missing.
+    def __init__(self, max_age_s=5):
+        self.max_age_s = max_age_s
+        self._lock = threading.Lock()
+        self._books = {}  # symbol -> (bid, ask, exchange ts ms, version, local receive time)
+        self.stats = {'updates': 0, 'out_of_order': 0, 'stale_reads': 0, 'missing_reads': 0}
+
+    def update(self, symbol, bid, ask, ts, version=None):
+        received = time.monotonic()
+        with self._lock:
+            cached = self._books.get(symbol)
+            if cached is not None:
+                _, _, cached_ts, cached_version, _ = cached
+                if ts < cached_ts or (ts == cached_ts and None not in (version, cached_version)
+                                      and version <= cached_version):
+                    self.stats['out_of_order'] += 1
+                    return False
+            self._books[symbol] = (bid, ask, ts, version, received)
+            self.stats['updates'] += 1
+        return True
+
+    def on_depth(self, message):
+        # message is a decoded public 'depth' push, data holds one book per entry
+        updated = False
+        for book in message.get('data') or []:
+            bids, asks = book.get('b'), book.get('a')
+            bid = float(bids[0][0]) if bids else None
+            ask = float(asks[0][0]) if asks else None
+            if bid is None and ask is None:
+                continue
+            updated |= self.update(book['s'], bid, ask, int(book['t']), _version(book.get('v')))
+        return updated
+
+    def on_book_ticker(self, tickers):
+        # REST /quote/v1/ticker/bookTicker snapshot
+        for ticker in tickers:
+            self.update(ticker['s'], float(ticker['b']), float(ticker['a']), int(ticker.get('t') or 0))
+
+    def quote(self, symbol):
+        # (bid, ask) if fresh, otherwise None
+        with self._lock:
+            cached = self._books.get(symbol)
+            if cached is None:
+                self.stats['missing_reads'] += 1
+                return None
+            bid, ask, _, _, received = cached
+            if time.monotonic() - received > self.max_age_s:
+                self.stats['stale_reads'] += 1
+                return None
+        return bid, ask
+
+    def best_bid(self, symbol):
+        quote = self.quote(symbol)
+        return quote[0] if quote else None
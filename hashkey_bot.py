@@ -1,79 +1,95 @@
-import hashlib
-import hmac
+import argparse
+import asyncio
+import functools
 import json
+import random
 import time
-import websocket
+import websockets
 import logging
-import threading
-import requests
 import datetime
-import configparser
-import pandas as pd
-import os
-
-config = configparser.ConfigParser()
-configFilePath = r'./config/config_hashkey.cfg'
-config.read(configFilePath)
-
-trade_pairs = config['DEFAULT']['trade_pairs'].split(',')
-dca_pairs = config['DEFAULT']['dca_pairs'].split(',')
-
-trade_pair_params = {}
-dca_pair_params = {}
-for pair in trade_pairs:
-    trade_pair_params[pair] = {
-        'buy_limit_margin': config[pair]['buy_limit_margin'],
-        'sell_limit_margin': config[pair]['sell_limit_margin'],
-        'trade_quantity': config[pair]['trade_quantity']
-    }    
-for pair in dca_pairs:    
-    dca_pair_params[pair] = {
-        'dca_amount': config[pair]['dca_amount']
-    }
-
-df_file_path = "./reports/trade_data.csv"
-if os.path.isfile(df_file_path):
-    trades_df = pd.read_csv(df_file_path)
-    print('Existing dataframe found and loaded')
-else:
-    columns = ['Strategy', 'Symbol', 'Buy_Time', 'Buy_ID', 'Buy_Qty', 'Buy_Price', 'Buy_Fee',
-               'Buy_Total', 'Sell_Time', 'Sell_ID', 'Sell_Qty', 'Sell_Price', 'Sell_Fee', 'Sell_Total', 'P_L']
-    trades_df = pd.DataFrame(columns=columns)
-    print('No dataframe found, create new')
-    trades_df.to_csv(df_file_path, index=False)
+from concurrent.futures import ThreadPoolExecutor
+
+from hashkey_book import BookCache
+from hashkey_config import CONFIG_PATH, DEFAULT_ACCOUNT, load_config
+from hashkey_dca import DcaScheduler
+from hashkey_ledger import TradeLedger, MATCHED, ORPHANED
+from hashkey_metrics import Metrics
+from hashkey_pipeline import FillPipeline
+from hashkey_requote import RequoteScheduler
+from hashkey_rest import HashKeyRestClient
+
+CLOSED_STATUSES = ('FILLED', 'CANCELED', 'PARTIALLY_CANCELED', 'REJECTED')
+# cancel rejections that mean the order is not live anymore: unknown order / order does not exist,
+# already filled, already cancelled
+CANCEL_CLOSED_CODES = {-2011, -2013, -1139, -1142}
+# most records one page of the order and trade history endpoints returns
+HISTORY_LIMIT = 1000
+
+
+def open_ledger(config):
+    # rebuild the ledger view from the sqlite store, a legacy csv ledger is only imported on first start
+    ledger = TradeLedger(config.ledger_path, csv_path=config.legacy_csv_path, history_paths=config.ledger_history_paths)
+    ledger_rows, ledger_open = ledger.count()
+    logging.getLogger(__name__).info(
+        f'Trade ledger {config.ledger_path} loaded: {ledger_rows} rows, {ledger_open} open buys')
+    return ledger
 
 
 class WebSocketClient:
-    def __init__(self, user_key, user_secret, subed_topic=[], subed_symbols=[]):
-        self.user_key = user_key
-        self.user_secret = user_secret
+    def __init__(self, config, ledger, subed_topic=[], subed_symbols=[]):
+        # config is a hashkey_config.BotConfig, ledger the TradeLedger (partition) of this client
+        self.config = config
+        self.ledger = ledger
+        self.user_key = config.access
+        self.user_secret = config.secret
         self.subed_topic = subed_topic
         self.subed_symbols = subed_symbols
         self.listen_key = None
         self._logger = logging.getLogger(__name__)
         self._ws = None
-        self._ping_thread = None
+        self._loop = None
+        self._main_task = None
+        self._executor = None
+        self._connected = None
         self.last_listen_key_extend = time.time()
-        self._limit_order_thread = None
-        self._DCA_thread = None
+        # wall time from which fills may have been missed, cleared once they are reconciled
+        self._stream_lost_at = time.time() - config.reconcile_lookback_s if config.reconcile_lookback_s else None
         self.polled_price = {}
-        self.ws_price = {}
+        # top of book from the public depth stream
+        self.book = BookCache(max_age_s=config.book_max_age_s)
+        # live buy order per pair, set when the depth cache moves a price
+        self._requote = RequoteScheduler(
+            {pair: float(params['requote_tolerance']) for pair, params in config.trade_pair_params.items()},
+            config.requote_max_age_s)
+        self._quote_event = asyncio.Event()
+        self._dca = DcaScheduler(
+            {pair: params['dca_schedule'] for pair, params in config.dca_pair_params.items()},
+            config.dca_state_path, config.dca_catchup_s)
+        # pooled keep-alive session shared by all REST calls, sized for the order workers
+        self._rest = HashKeyRestClient(config.access, config.secret, base_url=config.rest_base_url,
+                                       max_requests_per_s=config.rest_max_requests_per_s,
+                                       pool_size=config.pipeline_order_workers + config.rest_pool_size)
+        self._pipeline = FillPipeline(self._handle_fill, self._submit_order,
+                                      fill_workers=config.pipeline_fill_workers,
+                                      order_workers=config.pipeline_order_workers,
+                                      maxsize=config.pipeline_queue_size)
+        # hot path timings and counters, the component stats are exported alongside
+        self.metrics = Metrics()
+        self.metrics.register('pipeline', lambda: self._pipeline.stats())
+        self.metrics.register('rest', lambda: {'latency': self._rest.latency_stats(), 'calls': dict(self._rest.counters)})
+        self.metrics.register('book', lambda: self.book.stats)
+        self.metrics.register('requote', lambda: self._requote.stats)
+        self.metrics.register('ledger', lambda: self.ledger.stats)
+        self._frames_received = 0
+        # from construction to the first buy orders placed, i.e. how long a restart is off the book
+        self._created = time.monotonic()
+        self._on_book = False
 
     def generate_listen_key(self):
         params = {
             'timestamp': int(time.time() * 1000),
         }
-        api_headers = {
-            'X-HK-APIKEY': self.user_key,
-            'content-type': 'application/x-www-form-urlencoded;charset=UTF-8',
-        }
-        signature = self.create_hmac256_signature(
-            secret_key=self.user_secret, params=params)
-        params.update({
-            'signature': signature,
-        })
-        response = requests.post(
-            url=f"https://api-pro.hashkey.com/api/v1/userDataStream", headers=api_headers, data=params)
+        response = self._rest.signed_request('POST', '/api/v1/userDataStream', params)
         data = response.json()
         if 'listenKey' in data:
             self.listen_key = data['listenKey']
@@ -86,170 +102,249 @@ class WebSocketClient:
             'timestamp': int(time.time() * 1000),
             'listenKey': self.listen_key,
         }
-        api_headers = {
-            'X-HK-APIKEY': self.user_key,
-            'content-type': 'application/x-www-form-urlencoded;charset=UTF-8',
-        }
-        signature = self.create_hmac256_signature(
-            secret_key=self.user_secret, params=params)
-        params.update({
-            'signature': signature,
-        })
-        response = requests.put(
-            url=f"https://api-pro.hashkey.com/api/v1/userDataStream", headers=api_headers, data=params)
-        if response.status_code == 200:
+        try:
+            response = self._rest.signed_request('PUT', '/api/v1/userDataStream', params)
+            extended = response.status_code == 200
+        except Exception as e:
+            self._logger.error(f"Extend listen key error: {e}")
+            extended = False
+        if extended:
+            self.last_listen_key_extend = time.time()
             self._logger.info("Successfully extended listen key validity.")
         else:
             self._logger.error("Failed to extend listen key validity.")
-
-    def create_hmac256_signature(self, secret_key, params, data=""):
-        for k, v in params.items():
-            data = data + str(k) + "=" + str(v) + "&"
-        signature = hmac.new(
-            secret_key.encode(), data[:-1].encode(), digestmod=hashlib.sha256).hexdigest()
-        return signature
+        return extended
 
     def create_new_order(self, params):
+        response = None
+        try:
+            with self.metrics.timer('create_order'):
+                response = self._rest.signed_request('POST', '/api/v1/spot/order', params)
+                res = response.json()
+            self.metrics.inc('orders_sent')
+            return res
+        except Exception as e:
+            self.metrics.inc('order_errors')
+            self._logger.error(
+                f"Create new order error: {e} response received {response.text if response is not None else None}")
 
-        api_headers = {
-            'X-HK-APIKEY': self.user_key,
-            'content-type': 'application/x-www-form-urlencoded;charset=UTF-8',
+    def cancel_order(self, order_id):
+        # returns the response when the order is no longer live: cancelled now, or rejected with
+        # one of CANCEL_CLOSED_CODES. Anything else (transport error, rate limit, server error,
+        # a signature or timestamp rejection) leaves the order possibly live and returns None.
+        params = {
+            'orderId': order_id,
+            'timestamp': int(time.time() * 1000),
         }
-        signature = self.create_hmac256_signature(
-            secret_key=self.user_secret, params=params)
-
-        params.update({
-            'signature': signature,
-        })
-
+        response = None
         try:
-            response = requests.post(
-                url=f"https://api-pro.hashkey.com/api/v1/spot/order", headers=api_headers, data=params)
-
+            with self.metrics.timer('cancel_order'):
+                response = self._rest.signed_request('DELETE', '/api/v1/spot/order', params)
             res = response.json()
-            return res
+            code = res.get('code') if isinstance(res, dict) else None
+            if (response.status_code == 200 and not code) or code in CANCEL_CLOSED_CODES:
+                return res
+            raise Exception(f"HTTP {response.status_code}")
         except Exception as e:
             self._logger.error(
-                f"Create new order error: {e} response received {response.text}")
+                f"Cancel order error: {e} response received {response.text if response is not None else None}")
 
-    def cancel_all_buy_orders(self):
+    def cancel_all_buy_orders(self, symbol=None):
+        # all open buy orders, or only those of one symbol
         params = {
             'side': "BUY",
             'timestamp': int(time.time() * 1000),
         }
-        api_headers = {
-            "accept": "application/json",
-            'X-HK-APIKEY': self.user_key
-        }
-        signature = self.create_hmac256_signature(
-            secret_key=self.user_secret, params=params)
-        params.update({
-            'signature': signature,
-        })
-
+        if symbol:
+            params['symbol'] = symbol
+        response = None
         try:
-            response = requests.delete(
-                url=f"https://api-pro.hashkey.com/api/v1/spot/openOrders", headers=api_headers, data=params)
-
+            response = self._rest.signed_request('DELETE', '/api/v1/spot/openOrders', params)
             res = response.json()
             return res
         except Exception as e:
             self._logger.error(
-                f"Cancel buy orders error: {e} response received {response.text}")
+                f"Cancel buy orders error: {e} response received {response.text if response is not None else None}")
+
+    def _fetch_history(self, path, start_ms, end_ms):
+        # Every record of a history endpoint in the window. A page holds at most HISTORY_LIMIT records
+        # and which end of a fuller window gets cut is not documented, so a full page splits its window
+        # in two until every part comes back short. Raises rather than return part of the window.
+        records, windows = [], [(start_ms, end_ms)]
+        while windows:
+            start, end = windows.pop()
+            params = {'startTime': start, 'endTime': end, 'limit': HISTORY_LIMIT, 'timestamp': int(time.time() * 1000)}
+            page = self._rest.signed_request('GET', path, params).json()
+            if not isinstance(page, list):
+                raise Exception(f"{path} history error: {page}")
+            if len(page) < HISTORY_LIMIT:
+                records.extend(page)
+            elif end > start:
+                middle = (start + end) // 2
+                windows += [(middle + 1, end), (start, middle)]
+            else:
+                raise Exception(f"{path} history holds more than {HISTORY_LIMIT} records at {start}")
+        return records
+
+    def fetch_closed_orders(self, start_ms, end_ms):
+        # Orders closed in the window from REST history, shaped like the executionReports of the
+        # private stream. Commissions come from the account trade list, summed per order.
+        orders = self._fetch_history('/api/v1/spot/tradeOrders', start_ms, end_ms)
+        fees = {}
+        try:
+            for trade in self._fetch_history('/api/v1/account/trades', start_ms, end_ms):
+                fees[str(trade['orderId'])] = fees.get(str(trade['orderId']), 0) + float(trade['commission'])
+        except Exception as e:
+            self._logger.error(f"Trade history error, reconciled fills logged without fees: {e}")
+        reports = [{
+            'e': 'executionReport',
+            'E': int(order.get('updateTime') or order['time']),
+            's': order['symbol'],
+            'S': order['side'],
+            'o': order['type'],
+            'X': order['status'],
+            'i': str(order['orderId']),
+            'c': order.get('clientOrderId', ''),
+            'q': order['executedQty'],
+            'p': order['price'],
+            'n': str(fees.get(str(order['orderId']), 0)),
+            'Z': order['cummulativeQuoteQty'],
+            # not a stream field, fills the stream already delivered are expected among these
+            'replayed': True,
+        } for order in orders]
+        return sorted(reports, key=lambda report: report['E'])
 
     def _on_message(self, ws, message):
-        current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
-
+        start = time.perf_counter()
         data = json.loads(message)
+        self.metrics.observe('ws_parse', time.perf_counter() - start)
+        self.metrics.inc('frames')
         if "pong" in data or "ping" in data:
             # Received a pong message from the server
             # self._logger.info("Received pong message")
             pass
         else:
-            self._logger.info(f"{current_time} - Received message: {message}")
+            self._log_frame(message)
         # Handle the received market data here
         # Note Private WS does not provide public data, separate ws required
 
         # Handle the received private stream updates here
+        # fills are only queued on the event loop, see _handle_fill for the processing. Returns
+        # the fills that found the fill queue full, for _submit_overflow.
+        overflow = []
         if isinstance(data, list):
-            global trades_df
             for order in data:
-                try:
-                    if order["e"] == "executionReport" and order["S"] == "BUY" and order["o"] == "LIMIT" and order["X"] == "FILLED":
-                        # log the buy limit order in the df
-                        unix_timestamp_sec = int(order["E"]) / 1000
-                        dt_object = datetime.datetime.fromtimestamp(unix_timestamp_sec)
-                        readable_time = dt_object.strftime('%Y-%m-%d %H:%M:%S')
-                        new_trade = {
-                            'Strategy': "Market Maker",
-                            'Symbol': order["s"],
-                            'Buy_Time': readable_time,
-                            'Buy_ID': str(order["i"]),
-                            'Buy_Qty': order["q"],
-                            'Buy_Price': order["p"],
-                            'Buy_Fee': order["n"],
-                            'Buy_Total': order["Z"],
-                        }
-                        # Convert new_trade to a DataFrame
-                        new_trade_df = pd.DataFrame([new_trade])
-                        # Concatenate the new_trade_df with trades_df
-                        trades_df = pd.concat([trades_df, new_trade_df], ignore_index=True)
-                        # update the df to file for each order notification
-                        trades_df.to_csv(df_file_path, index=False)
-                        self._logger.info(f"Updated trades_df with new buy order: {new_trade}")
-
-                        # set up a limit sell order with profit margin
-                        sell_price = round(float(order['p']) * float(trade_pair_params[order['s']]['sell_limit_margin']))
-                        params = {
-                            "symbol": order['s'],
-                            "price": sell_price,
-                            "side": 'SELL',
-                            "type": 'LIMIT',
-                            "quantity": order['q'],
-                            'timestamp': int(time.time() * 1000),
-                            'newClientOrderId': str(order['i'])
-                        }
-                        self._logger.info(f"Sell limit order created: {self.create_new_order(params)}")
-
-                    if order["e"] == "executionReport" and order["S"] == "SELL" and order["o"] == "LIMIT" and order["X"] == "FILLED":
-                        # log the sell limit order in the df
-                        unix_timestamp_sec = int(order["E"]) / 1000
-                        dt_object = datetime.datetime.fromtimestamp(unix_timestamp_sec)
-                        readable_time = dt_object.strftime('%Y-%m-%d %H:%M:%S')
-
-                        # use client order ID to find the corresponding buy limit order
-                        search_trade = trades_df[trades_df['Buy_ID'].astype(str) == str(order['c'])]
-                        if search_trade.empty:
-                            self._logger.info(f"No matching buy trade ID '{order['c']}' found. Append to df.")
-                            new_trade = {
-                                'Sell_Time': readable_time,
-                                'Sell_ID': str(order["c"]),
-                                'Sell_Qty': order["q"],
-                                'Sell_Price': order["p"],
-                                'Sell_Fee': order["n"],
-                                'Sell_Total': order["Z"]
-                            }
-                            # Convert new_trade to a DataFrame
-                            new_trade_df = pd.DataFrame([new_trade])
-                            # Concatenate the new_trade_df with trades_df
-                            trades_df = pd.concat([trades_df, new_trade_df], ignore_index=True)
-                            # update the df to file for each order notification
-                            trades_df.to_csv(df_file_path, index=False)
-                            self._logger.info(f"Updated trades_df with new sell order: {new_trade}")
-                        else:
-                            self._logger.info(f"Matching buy trade ID '{order['c']}' found. Update record.")
-                            # Get the index of the first (and only) row
-                            # there should only be one match however
-                            row_index = search_trade.index[0]
-                            trades_df.loc[row_index, ['Sell_Time', 'Sell_ID', 'Sell_Qty',
-                                                      'Sell_Price', 'Sell_Fee', 'Sell_Total']
-                                          ] = [readable_time, str(order["c"]), order["q"], order["p"], order["n"], order["Z"]]
-
-                            # update the df to file for each order notification
-                            trades_df.to_csv(df_file_path, index=False)
-                            self._logger.info(f"Updated trades_df with sell order for existing buy order: {order['c']}")
-                except Exception as e:
-                    self._logger.error(f"Error processing order: {order}, error: {e}")
+                self._on_report(order, overflow)
+        return overflow
+
+    def _on_report(self, order, overflow):
+        # one executionReport, from the stream or replayed from REST history. The stream carries
+        # every order of the account, when workers share the keys each only handles its own pairs.
+        if order.get("s") not in self.config.trade_pair_params:
+            return
+        try:
+            if order["e"] == "executionReport" and order["o"] == "LIMIT" and order["X"] == "FILLED":
+                self.metrics.inc('fills')
+                # never wait for room on the event loop; once a fill is refused the rest of the batch
+                # queues up behind it, so the fills of a symbol keep their order
+                if overflow or not self._pipeline.submit_fill(order, block=False):
+                    overflow.append(order)
+            if order["e"] == "executionReport" and order["S"] == "BUY" and order["X"] in CLOSED_STATUSES:
+                # the pair has no live buy anymore, quote it again on the next check
+                self._requote.closed(order["s"], order["i"])
+                self._quote_event.set()
+        except Exception as e:
+            self._logger.error(f"Error processing order: {order}, error: {e}")
+
+    def _log_frame(self, message):
+        # per-frame logging is gated by level (DEBUG) or sampled at INFO, formatting a raw frame
+        # for every message costs more than handling it
+        self._frames_received += 1
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self._logger.debug(f"Received message: {message}")
+        elif self.config.frame_log_sample and self._frames_received % self.config.frame_log_sample == 0:
+            current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
+            self._logger.info(
+                f"{current_time} - Received message (1 in {self.config.frame_log_sample}): {message}")
+
+    def _handle_fill(self, order):
+        # runs on a fill worker, fills of one symbol are handled in the order they were received
+        with self.metrics.timer('fill_handle'):
+            self._process_fill(order)
+
+    def _process_fill(self, order):
+        unix_timestamp_sec = int(order["E"]) / 1000
+        dt_object = datetime.datetime.fromtimestamp(unix_timestamp_sec)
+        readable_time = dt_object.strftime('%Y-%m-%d %H:%M:%S')
+        replayed = order.get('replayed', False)
+
+        if order["S"] == "BUY":
+            if self.ledger.is_duplicate_buy(order["i"], replayed):
+                # the fill was already logged and its sell placed, e.g. a redelivered report
+                if replayed:
+                    self._logger.debug(f"Replayed buy trade ID '{order['i']}' already logged")
+                else:
+                    self._logger.warning(
+                        f"Duplicate buy trade ID '{order['i']}' ignored. Ledger stats: {self.ledger.stats}")
+                return
+
+            # set up a limit sell order with profit margin, queued before the ledger write
+            # so placing it does not wait on ledger I/O
+            params = self.config.trade_pair_params[order['s']]
+            sell_price = round(float(order['p']) * float(params['sell_limit_margin']))
+            self._pipeline.submit_order({
+                "symbol": order['s'],
+                "price": sell_price,
+                "side": 'SELL',
+                "type": 'LIMIT',
+                "quantity": order['q'],
+                'newClientOrderId': str(order['i'])
+            })
+
+            # log the buy limit order in the ledger, a single row insert
+            new_trade = {
+                'Strategy': "Market Maker",
+                'Symbol': order["s"],
+                'Buy_Time': readable_time,
+                'Buy_ID': str(order["i"]),
+                'Buy_Qty': order["q"],
+                'Buy_Price': order["p"],
+                'Buy_Fee': order["n"],
+                'Buy_Total': order["Z"],
+            }
+            with self.metrics.timer('ledger_write'):
+                self.ledger.log_buy(new_trade)
+            self._logger.info(f"Updated ledger with new buy order: {new_trade}")
+
+        elif order["S"] == "SELL":
+            sell_trade = {
+                'Sell_Time': readable_time,
+                'Sell_ID': str(order["c"]),
+                'Sell_Qty': order["q"],
+                'Sell_Price': order["p"],
+                'Sell_Fee': order["n"],
+                'Sell_Total': order["Z"]
+            }
+            # use client order ID to find the corresponding buy limit order,
+            # the matching row is updated in place or a sell-only row is appended
+            with self.metrics.timer('ledger_write'):
+                match = self.ledger.log_sell(order['c'], sell_trade, replayed)
+            if match == MATCHED:
+                self._logger.info(f"Updated ledger with sell order for existing buy order: {order['c']}")
+            elif match == ORPHANED:
+                self._logger.warning(
+                    f"No matching buy trade ID '{order['c']}' found. Appended sell order: {sell_trade}. "
+                    f"Ledger stats: {self.ledger.stats}")
+            elif replayed:
+                self._logger.debug(f"Replayed sell trade ID '{order['c']}' already logged")
+            else:
+                self._logger.warning(
+                    f"Duplicate sell trade ID '{order['c']}' ignored. Ledger stats: {self.ledger.stats}")
+
+    def _submit_order(self, params):
+        # runs on an order worker, the timestamp is taken at send time rather than when queued
+        params['timestamp'] = int(time.time() * 1000)
+        self._logger.info(f"Sell limit order created: {self.create_new_order(params)}")
 
     def _on_error(self, ws, error):
         self._logger.error(f"WebSocket error: {error}")
@@ -257,7 +352,15 @@ class WebSocketClient:
     def _on_close(self, ws):
         self._logger.info("Connection closed")
 
-    def _on_open(self, ws):
+    def _on_public_message(self, ws, message):
+        start = time.perf_counter()
+        data = json.loads(message)
+        self.metrics.observe('public_parse', time.perf_counter() - start)
+        if data.get("topic") == "depth" and self.book.on_depth(data):
+            self._quote_event.set()
+
+    async def _on_open(self, ws):
+        # public market data stream
         self._logger.info("Subscribing to topics")
         for topic in self.subed_topic:
             for symbol in self.subed_symbols:
@@ -270,128 +373,370 @@ class WebSocketClient:
                     },
                     "id": 1
                 }
-                ws.send(json.dumps(sub))
+                await ws.send(json.dumps(sub))
                 self._logger.info(f"Send message: {sub}")
 
-        # Start the ping thread after connecting
-        self._start_ping_thread()
-        self._start_limit_order_thread()
-        self._start_DCA_thread()
-
-    def _start_ping_thread(self):
-        def send_ping():
-            while self._ws:
-                current_time = time.time()
-                if current_time - self.last_listen_key_extend > 1800:  # Extend listen key every 30 minutes
-                    self.extend_listenKey_timeLimit()
-                    self.last_listen_key_extend = current_time
-
-                ping_message = {"ping": int(time.time() * 1000)}
-                self._ws.send(json.dumps(ping_message))
-                # self._logger.info(f"Sent ping message: {ping_message}")
-                time.sleep(5)
-
-        self._ping_thread = threading.Thread(target=send_ping)
-        self._ping_thread.daemon = True
-        self._ping_thread.start()
-
-    def _start_limit_order_thread(self):
-        def send_limit_orders():
-            while self._ws:
-                # cancel all buy limit orders
-                self._logger.info(
-                    f"Buy orders cancelled: {self.cancel_all_buy_orders()}")
-
-                # create new buy limit orders
-                self._get_polled_price()
-                self._logger.info(f"Polled price: {self.polled_price}")
+    async def _submit_overflow(self, fills):
+        # Backpressure off the event loop: the blocking puts run on a default executor thread and
+        # only the awaiting coroutine (the stream receive loop) stops until the fill workers catch
+        # up, pings, depth updates and re-quotes carry on.
+        for order in fills:
+            await self._loop.run_in_executor(None, self._pipeline.submit_fill, order)
+
+    async def _call(self, func, *args):
+        # blocking REST calls run on the shared executor, the event loop keeps serving the socket
+        return await self._loop.run_in_executor(self._executor, functools.partial(func, *args))
+
+    async def _ping_loop(self, ws):
+        # bound to one connection, cancelled together with it
+        while True:
+            ping_message = {"ping": int(time.time() * 1000)}
+            await ws.send(json.dumps(ping_message))
+            # self._logger.info(f"Sent ping message: {ping_message}")
+            await asyncio.sleep(5)
+
+    async def _public_stream_loop(self):
+        # Market data only arrives on the public stream. It is kept open for the whole run and
+        # reconnected on its own, REST snapshots cover the pairs while it is down.
+        stream_url = f"{self.config.stream_base_url}/quote/ws/v1"
+        while True:
+            try:
+                async with websockets.connect(stream_url, ping_interval=None) as ws:
+                    await self._on_open(ws)
+                    ping_task = asyncio.create_task(self._ping_loop(ws))
+                    try:
+                        async for message in ws:
+                            self._on_public_message(ws, message)
+                    except asyncio.CancelledError:
+                        # shutting down, a cancelled receive would otherwise close with 1011
+                        await ws.close()
+                        raise
+                    finally:
+                        ping_task.cancel()
+            except (OSError, websockets.WebSocketException) as e:
+                self._on_error(None, e)
+            await asyncio.sleep(1)
+
+    async def _listen_key_loop(self):
+        while True:
+            await asyncio.sleep(60)
+            current_time = time.time()
+            # Extend listen key every 30 minutes, while reconnecting the supervisor takes care of it.
+            # Only a successful extend moves last_listen_key_extend, a failed one is retried next minute.
+            if self.listen_key and current_time - self.last_listen_key_extend > 1800:
+                await self._call(self.extend_listenKey_timeLimit)
+
+    def _buy_limit_params(self, pair):
+        buy_price = round(float(self.polled_price[pair]) *
+                          float(self.config.trade_pair_params[pair]['buy_limit_margin']))
+        return {
+            "symbol": pair,
+            "price": buy_price,
+            "side": 'BUY',
+            "type": 'LIMIT',
+            "quantity": self.config.trade_pair_params[pair]['trade_quantity'],
+            'timestamp': int(time.time() * 1000),
+        }
 
-                for pair in trade_pairs:
-                    buy_price = round(float(self.polled_price[pair]) *
-                                      float(trade_pair_params[pair]['buy_limit_margin']))
-                    params = {
-                        "symbol": pair,
-                        "price": buy_price,
-                        "side": 'BUY',
-                        "type": 'LIMIT',
-                        "quantity": trade_pair_params[pair]['trade_quantity'],
-                        'timestamp': int(time.time() * 1000),
-                    }
-                    self._logger.info(
-                        f"New buy limit orders created: {self.create_new_order(params)}")
-
-                timeout = int(config['DEFAULT']['trade_interval_s'])
-
-                time.sleep(timeout)
-
-        self._limit_order_thread = threading.Thread(target=send_limit_orders)
-        self._limit_order_thread.daemon = True
-        self._limit_order_thread.start()
-
-    def _start_DCA_thread(self):
-        def send_DCA_orders():
-            while self._ws:
-                # run scheduled dca buy market orders
-                hour = datetime.datetime.now().hour   # the current hour
-                minute = datetime.datetime.now().minute  # the current minute
-
-                if hour == int(config['DEFAULT']['dca_hour']) and minute == int(config['DEFAULT']['dca_minute']):
-                    for pair in dca_pairs:
-                        amt = round(
-                            float(dca_pair_params[pair]['dca_amount']))
-                        dca_params = {
-                            "symbol": pair,
-                            "side": 'BUY',
-                            "type": 'market',
-                            "quantity": amt,  # v1 api - quantity is amount for market buy
-                            'timestamp': int(time.time() * 1000),
-                        }
-                        # execute market buy order for dca, assume sleep is > 60s so not checking seconds
-                        self._logger.info(
-                            f"New buy market orders created: {self.create_new_order(dca_params)}")
-                time.sleep(60)
-        self._DCA_thread = threading.Thread(target=send_DCA_orders)
-        self._DCA_thread.daemon = True
-        self._DCA_thread.start()
+    async def _requote_pair(self, pair):
+        # replace the live buy of one pair with a targeted cancel, then place at the current price
+        start = time.perf_counter()
+        live = self._requote.live.get(pair)
+        cancelled = None
+        if live is not None:
+            cancelled = await self._call(self.cancel_order, live['order_id'])
+            if cancelled is None:
+                # unknown whether it is still live, do not risk a second order, retry after a backoff
+                retry_s = self._requote.failed(pair, time.monotonic())
+                return {'cancel': None, 'order': None, 'retry_s': retry_s, 'latency_s': time.perf_counter() - start}
+            self._requote.cancelled(pair)
+        params = self._buy_limit_params(pair)
+        order = await self._call(self.create_new_order, params)
+        if order and 'orderId' in order:
+            self._requote.placed(pair, order['orderId'], self.polled_price[pair], time.monotonic())
+        else:
+            # rejected (e.g. insufficient balance) or lost, the pair has no live order until the backoff ran out
+            retry_s = self._requote.failed(pair, time.monotonic())
+            self.metrics.observe('requote_pair', time.perf_counter() - start)
+            return {'cancel': cancelled, 'order': order, 'retry_s': retry_s, 'latency_s': time.perf_counter() - start}
+        self.metrics.observe('requote_pair', time.perf_counter() - start)
+        return {'cancel': cancelled, 'order': order, 'latency_s': time.perf_counter() - start}
+
+    async def requote_pairs(self, pairs):
+        # re-quote the pairs concurrently, returns the per pair results and the cycle wall time
+        start = time.perf_counter()
+        results = await asyncio.gather(*(self._requote_pair(pair) for pair in pairs), return_exceptions=True)
+        return {
+            'results': dict(zip(pairs, results)),
+            'wall_time_s': time.perf_counter() - start,
+        }
+
+    async def _limit_order_loop(self):
+        # Event driven: woken by depth updates and order closes, and at least once a second for the
+        # age check. Only pairs whose target price left the tolerance band, whose order is too old
+        # or that have no live order are touched.
+        await self._connected.wait()
+        # start from a clean book, orders of a previous run are not tracked. Other workers on the
+        # same keys keep their orders, only this client's pairs are cleared then.
+        if self.config.account_shards > 1:
+            cancelled = await asyncio.gather(*(self._call(self.cancel_all_buy_orders, pair)
+                                               for pair in self.config.trade_pairs))
+        else:
+            cancelled = await self._call(self.cancel_all_buy_orders)
+        self._logger.info(f"Buy orders cancelled: {cancelled}")
+        last_report = 0
+        while True:
+            await self._connected.wait()
+            try:
+                await asyncio.wait_for(self._quote_event.wait(), timeout=1)
+            except asyncio.TimeoutError:
+                pass
+            self._quote_event.clear()
+
+            self.polled_price = await self._refresh_prices()
+            due = self._requote.due(self.polled_price, time.monotonic())
+            if due:
+                requote = await self.requote_pairs(list(due))
+                self.metrics.observe('requote_cycle', requote['wall_time_s'])
+                for pair, result in requote['results'].items():
+                    self._logger.info(f"{pair} buy limit order re-quoted ({due[pair]}): {result}")
+                self._logger.info(f"Re-quote of {len(due)} pairs took {requote['wall_time_s']:.3f}s")
+                if not self._on_book:
+                    self._on_book = True
+                    self.metrics.observe('startup', time.monotonic() - self._created)
+                    self._logger.info(f"On the book {time.monotonic() - self._created:.3f}s after start")
+
+            if time.monotonic() - last_report > self.config.trade_interval_s:
+                last_report = time.monotonic()
+                missing = set(self.config.trade_pairs) - set(self.polled_price)
+                if missing:
+                    self._logger.error(f"No fresh price, not quoting: {missing}")
+                self._logger.info(f"Polled price: {self.polled_price}")
+                self._logger.info(f"Live buy orders: {self._requote.live}")
+                self._logger.info(f"Re-quote stats: {self._requote.stats}")
+                self._logger.info(f"Book cache stats: {self.book.stats}")
+                self._logger.info(f"Latency: {self.metrics.summary()} counters: {self.metrics.counters}")
+                self._logger.info(f"Pipeline stats: {self._pipeline.stats()}")
+                self._logger.info(f"REST latency: {self._rest.latency_stats()}")
+
+    async def _dca_loop(self):
+        # Sleeps until the next scheduled buy, in steps of at most a minute so wall clock
+        # changes are picked up. Due pairs are bought concurrently.
+        while self._dca.next_due() is not None:
+            wait = (self._dca.next_due() - datetime.datetime.now()).total_seconds()
+            if wait > 0:
+                await asyncio.sleep(min(wait, 60))
+                continue
+            due = self._dca.pop_due(datetime.datetime.now())
+            start = time.perf_counter()
+            results = await asyncio.gather(
+                *(self._call(self.create_new_order, self._dca_params(pair)) for pair in due), return_exceptions=True)
+            self.metrics.observe('dca_cycle', time.perf_counter() - start)
+            for pair, result in zip(due, results):
+                self._logger.info(f"New buy market order created for {pair}: {result}")
+
+    def _dca_params(self, pair):
+        return {
+            "symbol": pair,
+            "side": 'BUY',
+            "type": 'market',
+            "quantity": self.config.dca_pair_params[pair]['dca_amount'],
+            'timestamp': int(time.time() * 1000),
+        }
 
     def _get_polled_price(self):
-        url = "https://api-pro.hashkey.com/quote/v1/ticker/bookTicker"
-        headers = {"accept": "application/json"}
+        # REST snapshot of the best bids, also refreshes the book cache
+        prices = {}
         try:
-            response = requests.get(url, headers=headers)
+            with self.metrics.timer('price_poll'):
+                response = self._rest.public_request('GET', '/quote/v1/ticker/bookTicker')
             # print(type(response), response.text)
-            for pair in response.json():
-                self.polled_price[pair['s']] = float(pair['b'])
+            tickers = response.json()
+            self.book.on_book_ticker(tickers)
+            for pair in tickers:
+                prices[pair['s']] = float(pair['b'])
         except Exception as e:
             self._logger.error(f"Get price error: {e}")
-
-    def connect(self):
+        return prices
+
+    async def _refresh_prices(self):
+        # best bids from the depth cache, one REST snapshot only if a pair is missing or stale
+        prices = {pair: self.book.best_bid(pair) for pair in self.config.trade_pairs}
+        if None in prices.values():
+            self.metrics.inc('price_poll_fallbacks')
+            await self._call(self._get_polled_price)
+            prices = {pair: self.book.best_bid(pair) for pair in self.config.trade_pairs}
+        return {pair: bid for pair, bid in prices.items() if bid is not None}
+
+    async def run(self):
+        # Single event loop for the websocket, the timers and (via the executor) the REST calls.
+        # Timers are created once per run and outlive a connection, the ping loop and fill
+        # reconciliation belong to the connection, so reconnecting never stacks up duplicate loops.
+        self._loop = asyncio.get_running_loop()
+        self._main_task = asyncio.current_task()
+        self._connected = asyncio.Event()
+        self._executor = ThreadPoolExecutor(max_workers=self.config.rest_pool_size, thread_name_prefix='rest')
+        self._pipeline.start()
+        if self.config.metrics_port:
+            self.metrics.serve(self.config.metrics_port)
+        timers = [asyncio.create_task(self._public_stream_loop()),
+                  asyncio.create_task(self._listen_key_loop()),
+                  asyncio.create_task(self._limit_order_loop()),
+                  asyncio.create_task(self._dca_loop())]
+        try:
+            await self._supervise_stream()
+        finally:
+            for task in timers:
+                task.cancel()
+            await asyncio.gather(*timers, return_exceptions=True)
+            # drain the queues off the loop and for a bounded time, at the REST rate cap a long
+            # order backlog would otherwise hold the shutdown for minutes
+            dropped = await asyncio.get_running_loop().run_in_executor(
+                None, self._pipeline.stop, self.config.shutdown_drain_s)
+            if dropped['fills']:
+                # not in the ledger yet, the next start replays them if they are within reconcile_lookback_s
+                self._logger.error(f"{len(dropped['fills'])} fills left unprocessed at shutdown")
+            for params in dropped['orders']:
+                self._logger.error(f"Sell order not placed at shutdown: {params}")
+            self._executor.shutdown(wait=False)
+            self.metrics.close()
+
+    async def _supervise_stream(self):
+        # Keep the private stream up: reconnect with jittered exponential backoff (reset once a
+        # connection has been stable for a while), reuse the listen key if it can still be
+        # extended and generate a new one otherwise.
+        delay = self.config.reconnect_min_s
+        while True:
+            connected_at = time.monotonic()
+            try:
+                await self._ensure_listen_key()
+                connected_at = time.monotonic()
+                await self._run_connection()
+            except websockets.InvalidHandshake as e:
+                # e.g. the listen key expired while we were away
+                self._on_error(None, e)
+                self.listen_key = None
+            except Exception as e:
+                self._on_error(None, e)
+            if time.monotonic() - connected_at > 30:
+                delay = self.config.reconnect_min_s
+            wait = random.uniform(delay / 2, delay)
+            self.metrics.inc('reconnects')
+            self._logger.warning(f"Private stream down, reconnecting in {wait:.1f}s")
+            await asyncio.sleep(wait)
+            delay = min(self.config.reconnect_max_s, delay * 2)
+
+    async def _ensure_listen_key(self):
+        if self.listen_key and not await self._call(self.extend_listenKey_timeLimit):
+            self.listen_key = None
         if not self.listen_key:
-            self.generate_listen_key()
-
-        base_url = 'wss://stream-pro.hashkey.com'
+            await self._call(self.generate_listen_key)
+            self.last_listen_key_extend = time.time()
+
+    async def _reconcile_fills(self):
+        # Replay orders closed since the stream was lost (minus a margin for frames in flight)
+        # through the normal report path. The ledger drops fills it already has, so a fill seen
+        # on both the stream and in history is handled once.
+        since = self._stream_lost_at - 5
+        start = time.perf_counter()
+        try:
+            reports = await self._call(self.fetch_closed_orders, int(since * 1000), int(time.time() * 1000))
+        except Exception as e:
+            self._logger.error(f"Fill reconciliation failed, retried on the next connect: {e}")
+            return
+        overflow = []
+        for report in reports:
+            self._on_report(report, overflow)
+        await self._submit_overflow(overflow)
+        self._stream_lost_at = None
+        self.metrics.observe('reconcile', time.perf_counter() - start)
+        self.metrics.inc('reconciled_reports', len(reports))
+        self._logger.info(f"Reconciled {len(reports)} orders closed since "
+                          f"{datetime.datetime.fromtimestamp(since)} in {time.perf_counter() - start:.3f}s")
+
+    async def _run_connection(self):
+        base_url = self.config.stream_base_url
         endpoint = f'api/v1/ws/{self.listen_key}'
         stream_url = f"{base_url}/{endpoint}"
         self._logger.info(f"Connecting to {stream_url}")
 
-        self._ws = websocket.WebSocketApp(stream_url,
-                                          on_message=self._on_message,
-                                          on_error=self._on_error,
-                                          on_close=self._on_close)
-        self._ws.on_open = self._on_open
+        ping_task = None
+        reconcile_task = None
+        try:
+            async with websockets.connect(stream_url, ping_interval=None) as ws:
+                self._ws = ws
+                self._logger.info("Private stream connected")
+                ping_task = asyncio.create_task(self._ping_loop(ws))
+                self._connected.set()
+                if self._stream_lost_at is not None:
+                    reconcile_task = asyncio.create_task(self._reconcile_fills())
+                try:
+                    async for message in ws:
+                        overflow = self._on_message(ws, message)
+                        if overflow:
+                            await self._submit_overflow(overflow)
+                except asyncio.CancelledError:
+                    # shutting down, send a normal close frame before leaving
+                    await ws.close()
+                    raise
+        except websockets.ConnectionClosed as e:
+            self._on_error(self._ws, e)
+        finally:
+            self._connected.clear()
+            if self._stream_lost_at is None:
+                self._stream_lost_at = time.time()
+            tasks = [task for task in (ping_task, reconcile_task) if task]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._on_close(self._ws)
+            self._ws = None
 
-        self._ws.run_forever()
+    def connect(self):
+        try:
+            asyncio.run(self.run())
+        except asyncio.CancelledError:
+            self._logger.info("Client stopped")
+
+    def stop(self):
+        # thread safe, cancels the run task which closes the socket and all loops
+        self._loop.call_soon_threadsafe(self._main_task.cancel)
+
+    def health(self):
+        # snapshot for a supervisor, safe to call from another thread
+        now = time.time()
+        return {
+            'connected': bool(self._connected and self._connected.is_set()),
+            'stream_lost_s': round(now - self._stream_lost_at, 1) if self._stream_lost_at else 0,
+            'listen_key_age_s': round(now - self.last_listen_key_extend, 1),
+            'priced_pairs': len(self.polled_price),
+            'live_buys': len(self._requote.live),
+            'counters': dict(self.metrics.counters),
+            'latency': self.metrics.summary(),
+            'pipeline': self._pipeline.stats(),
+            'ledger': dict(self.ledger.stats),
+            'pnl': self.ledger.summary(),
+        }
 
 
-if __name__ == '__main__':
+def main():
+    from hashkey_supervisor import plan_workers, rebalance_ledgers
+
+    parser = argparse.ArgumentParser(description='HashKey market maker and DCA bot, one account in one process')
+    parser.add_argument('--config', default=CONFIG_PATH)
+    parser.add_argument('--account', help='[account:NAME] section to trade with, DEFAULT keys otherwise')
+    args = parser.parse_args()
     logging.basicConfig(level=logging.INFO)
 
-    user_key = config['DEFAULT']['access']
-    user_secret = config['DEFAULT']['secret']
+    # the single worker plan of hashkey_supervisor --shards 1: same ledger path, and open buys left in
+    # the partitions of an earlier sharded run are moved back before trading starts
+    spec = plan_workers(args.config, 1, [args.account or DEFAULT_ACCOUNT])[0]
+    rebalance_ledgers([spec])
+    config = load_config(args.config, spec['account'], spec['trade_pairs'], spec['dca_pairs'], **spec['overrides'])
     subed_topics = ["depth"]
-    subed_symbols = ["BTCUSD", "BTCHKD"]
+    client = WebSocketClient(config, open_ledger(config), subed_topics, config.trade_pairs)
+    client.connect()
 
-    client = WebSocketClient(user_key, user_secret,
-                             subed_topics, subed_symbols)
 
-    client.connect()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import configparser
+
+from hashkey_dca import CronSchedule
+from hashkey_rest import BASE_URL
+
+CONFIG_PATH = './config/config_hashkey.cfg'
+# extra API keys, e.g. [account:second] with its own access/secret; unset keys fall back to DEFAULT
+ACCOUNT_PREFIX = 'account:'
+DEFAULT_ACCOUNT = 'default'
+
+
+def read_config(path=CONFIG_PATH):
+    config = configparser.ConfigParser()
+    if not config.read(path):
+        raise FileNotFoundError(f"config file {path} not found")
+    return config
+
+
+def accounts(config):
+    # account names of the [account:...] sections, or only the DEFAULT keys if there are none
+    names = [section[len(ACCOUNT_PREFIX):] for section in config.sections() if section.startswith(ACCOUNT_PREFIX)]
+    return names or [DEFAULT_ACCOUNT]
+
+
+def _pairs(value):
+    return [pair.strip() for pair in value.split(',') if pair.strip()]
+
+
+class BotConfig:
+    # Everything one WebSocketClient needs, parsed once. trade_pairs and dca_pairs default to the
+    # account's lists, a supervisor passes the subset one worker trades.
+    def __init__(self, config, account=None, trade_pairs=None, dca_pairs=None):
+        section = config[ACCOUNT_PREFIX + account] if account and account != DEFAULT_ACCOUNT else config['DEFAULT']
+        self.account = account or DEFAULT_ACCOUNT
+        self.access = section['access']
+        self.secret = section['secret']
+        self.trade_pairs = list(trade_pairs) if trade_pairs is not None else _pairs(section['trade_pairs'])
+        self.dca_pairs = list(dca_pairs) if dca_pairs is not None else _pairs(section['dca_pairs'])
+
+        self.trade_pair_params = {}
+        self.dca_pair_params = {}
+        for pair in self.trade_pairs:
+            self.trade_pair_params[pair] = {
+                'buy_limit_margin': config[pair]['buy_limit_margin'],
+                'sell_limit_margin': config[pair]['sell_limit_margin'],
+                'trade_quantity': config[pair]['trade_quantity'],
+                # re-quote once the target price moves this much (relative) away from the live order
+                'requote_tolerance': config[pair].get('requote_tolerance', '0.001')
+            }
+        for pair in self.dca_pairs:
+            self.dca_pair_params[pair] = {
+                # v1 api - quantity is amount for market buy
+                'dca_amount': round(float(config[pair]['dca_amount'])),
+                # 'HH:MM' or cron entries separated by ';', by default once a day at dca_hour:dca_minute
+                'dca_schedule': [CronSchedule(spec) for spec in config[pair].get(
+                    'dca_schedule', f"{section['dca_minute']} {section['dca_hour']} * * *").split(';')],
+            }
+
+        # rebuild the ledger view from the sqlite store, a legacy csv ledger is only imported on first start
+        self.ledger_path = section.get('ledger_path', './reports/trade_data.db')
+        self.legacy_csv_path = section.get('legacy_csv_path', './reports/trade_data.csv')
+        # the account's other ledger files, replayed fills are checked against them too (set by the supervisor plan)
+        self.ledger_history_paths = []
+
+        # fill processing pipeline sizing, fills and orders of one symbol always share a worker
+        self.pipeline_fill_workers = int(section.get('pipeline_fill_workers', 2))
+        self.pipeline_order_workers = int(section.get('pipeline_order_workers', 4))
+        self.pipeline_queue_size = int(section.get('pipeline_queue_size', 1000))
+
+        # REST endpoint (override to point the bot at a local stub) and client side request rate cap
+        self.rest_base_url = section.get('rest_url', BASE_URL)
+        self.rest_max_requests_per_s = float(section.get('rest_max_requests_per_s', 10))
+        # threads the event loop hands blocking REST calls to, by default enough to re-quote every pair at once
+        self.rest_pool_size = int(section.get('rest_pool_size', max(8, len(self.trade_pairs) + 2)))
+        self.stream_base_url = section.get('stream_url', 'wss://stream-pro.hashkey.com')
+        # depth cache quotes older than this fall back to a REST snapshot
+        self.book_max_age_s = float(section.get('book_max_age_s', 5))
+
+        self.trade_interval_s = int(section['trade_interval_s'])
+        # live buy orders are replaced at the latest after this age, even if the price has not moved
+        self.requote_max_age_s = float(section.get('requote_max_age_s', self.trade_interval_s))
+        # last executed dca slot per pair, and how late a slot missed while stopped may still be bought
+        self.dca_state_path = section.get('dca_state_path', './reports/dca_state.json')
+        self.dca_catchup_s = float(section.get('dca_catchup_s', 3600))
+        # private stream reconnect backoff; fills closed while the stream was down are replayed from REST
+        # history, on startup those of the last reconcile_lookback_s (0: none)
+        self.reconnect_min_s = float(section.get('reconnect_min_s', 1))
+        self.reconnect_max_s = float(section.get('reconnect_max_s', 60))
+        self.reconcile_lookback_s = float(section.get('reconcile_lookback_s', 600))
+        # local Prometheus-style /metrics endpoint, 0 disables it (the stats log still carries a summary)
+        self.metrics_port = int(section.get('metrics_port', 0))
+        # raw stream frames are logged at DEBUG, at INFO only one frame in this many (0: none)
+        self.frame_log_sample = int(section.get('frame_log_sample', 0))
+
+        # worker processes per account under hashkey_supervisor, and how many of them share this
+        # account's keys at run time (the private stream then carries other workers' orders too)
+        self.shards = int(section.get('shards', 1))
+        self.account_shards = 1
+        # how long a stopping bot keeps handling queued fills and orders, the rest is logged and dropped
+        self.shutdown_drain_s = float(section.get('shutdown_drain_s', 10))
+        # seconds between the health and P&L reports a worker sends to the supervisor
+        self.status_interval_s = float(section.get('status_interval_s', 30))
+
+
+def load_config(path=CONFIG_PATH, account=None, trade_pairs=None, dca_pairs=None, **overrides):
+    # overrides replace parsed settings by attribute name, e.g. ledger_path for a worker's partition
+    bot_config = BotConfig(read_config(path), account, trade_pairs, dca_pairs)
+    for key, value in overrides.items():
+        if not hasattr(bot_config, key):
+            raise AttributeError(f"unknown setting {key}")
+        setattr(bot_config, key, value)
+    return bot_config
@@ -0,0 +1,126 @@
+import datetime
+import json
+import logging
+import os
+import re
+
+_HH_MM = re.compile(r'(\d{1,2}):(\d{2})\Z')
+
+
+def _cron_field(spec, lo, hi):
+    # '*', '5', '1-5', '*/15', '0-30/10' and comma separated lists of those
+    values = set()
+    for part in spec.split(','):
+        span, _, step = part.partition('/')
+        if span == '*':
+            start, end = lo, hi
+        elif '-' in span:
+            start, end = (int(v) for v in span.split('-'))
+        else:
+            start = int(span)
+            end = hi if step else start
+        if not lo <= start <= end <= hi:
+            raise ValueError(f"cron field '{spec}' out of range {lo}-{hi}")
+        values.update(range(start, end + 1, int(step) if step else 1))
+    return sorted(values)
+
+
+class CronSchedule:
+    # 'minute hour day-of-month month day-of-week' (day-of-week 0-7, 0 and 7 are Sunday), or
+    # 'HH:MM' for once a day. As in cron, a restricted day-of-month and day-of-week match
+    # either of them.
+    def __init__(self, spec):
+        self.spec = spec.strip()
+        match = _HH_MM.match(self.spec)
+        fields = f"{int(match[2])} {int(match[1])} * * *".split() if match else self.spec.split()
+        if len(fields) != 5:
+            raise ValueError(f"bad schedule '{spec}', expected 'HH:MM' or five cron fields")
+        self.minutes = _cron_field(fields[0], 0, 59)
+        self.hours = _cron_field(fields[1], 0, 23)
+        self.days = set(_cron_field(fields[2], 1, 31))
+        self.months = set(_cron_field(fields[3], 1, 12))
+        self.weekdays = {d % 7 for d in _cron_field(fields[4], 0, 7)}
+        self._any_day = fields[2] == '*'
+        self._any_weekday = fields[4] == '*'
+
+    def _day_matches(self, date):
+        if date.month not in self.months:
+            return False
+        day_ok = date.day in self.days
+        weekday_ok = (date.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day_ok and weekday_ok
+        return day_ok or weekday_ok
+
+    def next_after(self, when):
+        # first scheduled minute strictly after when (naive local datetime)
+        start = when.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        date = start.date()
+        for _ in range(366 * 5):
+            if self._day_matches(date):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        slot = datetime.datetime.combine(date, datetime.time(hour, minute))
+                        if slot >= start:
+                            return slot
+            date += datetime.timedelta(days=1)
+        raise ValueError(f"schedule '{self.spec}' never fires")
+
+
+class DcaScheduler:
+    # Next due time per pair from its schedules, with the last executed slot persisted so a
+    # restart neither repeats a buy nor forgets one. A slot missed while the bot was down is
+    # run once on startup if it is less than catchup_s old.
+    # The slot is recorded before the order goes out: a crash in between loses one buy
+    # rather than doubling it.
+    def __init__(self, schedules, state_path, catchup_s=3600, now=None):
+        self.schedules = schedules  # pair -> [CronSchedule]
+        self.catchup_s = catchup_s
+        self._state_path = state_path
+        self._logger = logging.getLogger(__name__)
+        self.last_run = self._load()
+        now = now or datetime.datetime.now()
+        self.next_run = {pair: self._first_due(pair, now) for pair in schedules}
+
+    def _load(self):
+        try:
+            with open(self._state_path) as f:
+                return {pair: float(ts) for pair, ts in json.load(f).items()}
+        except FileNotFoundError:
+            return {}
+        except (ValueError, AttributeError) as e:
+            self._logger.error(f"Ignoring unreadable DCA state {self._state_path}: {e}")
+            return {}
+
+    def _save(self):
+        tmp = self._state_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.last_run, f)
+        os.replace(tmp, self._state_path)
+
+    def _next_slot(self, pair, after):
+        return min(schedule.next_after(after) for schedule in self.schedules[pair])
+
+    def _first_due(self, pair, now):
+        last = self.last_run.get(pair)
+        if last is not None:
+            start = max(datetime.datetime.fromtimestamp(last), now - datetime.timedelta(seconds=self.catchup_s))
+            slot = self._next_slot(pair, start)
+            if slot <= now:
+                self._logger.warning(f"DCA {pair} missed at {slot}, running it now")
+                return slot
+        return self._next_slot(pair, now)
+
+    def next_due(self):
+        return min(self.next_run.values()) if self.next_run else None
+
+    def pop_due(self, now):
+        # pairs due at now, their slots recorded and the next ones (after now, so missed slots
+        # never pile up) scheduled
+        due = [pair for pair, slot in self.next_run.items() if slot <= now]
+        for pair in due:
+            self.last_run[pair] = self.next_run[pair].timestamp()
+            self.next_run[pair] = self._next_slot(pair, max(self.next_run[pair], now))
+        if due:
+            self._save()
+        return due
@@ -0,0 +1,239 @@
+import csv
+import logging
+import os
+import sqlite3
+import threading
+
+LEDGER_COLUMNS = ['Strategy', 'Symbol', 'Buy_Time', 'Buy_ID', 'Buy_Qty', 'Buy_Price', 'Buy_Fee',
+                  'Buy_Total', 'Sell_Time', 'Sell_ID', 'Sell_Qty', 'Sell_Price', 'Sell_Fee', 'Sell_Total', 'P_L']
+SELL_COLUMNS = ['Sell_Time', 'Sell_ID', 'Sell_Qty', 'Sell_Price', 'Sell_Fee', 'Sell_Total']
+TEXT_COLUMNS = {'Strategy', 'Symbol', 'Buy_Time', 'Buy_ID', 'Sell_Time', 'Sell_ID'}
+# rows of buys still waiting for their sell, the condition of the partial index idx_trades_open
+OPEN_BUY = 'Buy_ID IS NOT NULL AND Sell_ID IS NULL'
+
+
+MATCHED = 'matched'
+ORPHANED = 'orphaned'
+DUPLICATE = 'duplicate'
+
+
+class TradeLedger:
+    # Round-trip ledger kept in a SQLite table in WAL mode. A buy fill is one INSERT and a
+    # sell match is one UPDATE of the matching row, so the cost of a fill no longer grows
+    # with the size of the history (the old path rewrote the whole CSV on every fill).
+    # Open buys have a partial index on Buy_ID (the client order ID of the follow-up sell), so
+    # matching a sell fill is one index lookup and opening the ledger reads nothing up front:
+    # a restart takes milliseconds however long the history or the list of open buys.
+    # history_paths are the other ledger files of the account. A fill replayed from REST history may
+    # belong to a round trip that a different partition traded before the last reshard; only the
+    # open buys move, so replayed fills are also looked up there (read only) before acting on them.
+    def __init__(self, db_path, csv_path=None, history_paths=()):
+        new_db = not os.path.isfile(db_path)
+        self._db_path = db_path
+        self._history_paths = [path for path in history_paths if os.path.abspath(path) != os.path.abspath(db_path)]
+        self._lock = threading.Lock()
+        self._logger = logging.getLogger(__name__)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        # WAL + NORMAL only fsyncs on checkpoint, a crash can lose the last commit but never corrupts
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        columns = ', '.join(
+            f"{col} {'TEXT' if col in TEXT_COLUMNS else 'REAL'}" for col in LEDGER_COLUMNS)
+        self._conn.execute(f'CREATE TABLE IF NOT EXISTS trades ({columns})')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_trades_buy_id ON trades (Buy_ID)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_trades_sell_id ON trades (Sell_ID)')
+        # built once when an older ledger is first opened
+        self._conn.execute(f'CREATE INDEX IF NOT EXISTS idx_trades_open ON trades (Buy_ID) WHERE {OPEN_BUY}')
+        self._conn.commit()
+
+        # reports read on a connection of their own: a WAL reader sees the last commit without
+        # waiting for writers, so a full scan never holds up the fill workers behind self._lock
+        self._reader = None
+        self._reader_lock = threading.Lock()
+
+        # fills replayed from REST history that the stream had already delivered are expected,
+        # they are counted apart from the duplicates that point at a problem
+        self.stats = {'orphaned_sells': 0, 'duplicate_buy_ids': 0, 'duplicate_sells': 0, 'replayed_duplicates': 0,
+                      'unmatchable_ids': 0}
+
+        # one-off migration of the legacy csv ledger
+        if new_db and csv_path and os.path.isfile(csv_path):
+            self.import_csv(csv_path)
+        # open buys sharing a Buy_ID, only the first of them is ever matched
+        self.stats['duplicate_buy_ids'] = self._conn.execute(
+            f'SELECT COUNT(*) - COUNT(DISTINCT Buy_ID) FROM trades INDEXED BY idx_trades_open '
+            f'WHERE {OPEN_BUY}').fetchone()[0]
+
+    def _open_row(self, buy_id):
+        # sells have always been matched to the earliest open buy of their Buy_ID
+        row = self._conn.execute(
+            f'SELECT rowid FROM trades INDEXED BY idx_trades_open WHERE {OPEN_BUY} AND Buy_ID = ? '
+            f'ORDER BY rowid LIMIT 1', (buy_id,)).fetchone()
+        return row[0] if row else None
+
+    def import_csv(self, csv_path):
+        with open(csv_path, newline='') as f:
+            rows = [[_normalise_id(row.get(col)) if col in ('Buy_ID', 'Sell_ID') else row.get(col) or None
+                     for col in LEDGER_COLUMNS] for row in csv.DictReader(f)]
+        # Ids that are not integers lost digits in a float column and can never match an order
+        # again: an open buy among them turns its sell into an orphan. They are imported as they
+        # are, so the history stays complete, and every such row is logged to be fixed by hand.
+        id_columns = [LEDGER_COLUMNS.index('Buy_ID'), LEDGER_COLUMNS.index('Sell_ID')]
+        for number, row in enumerate(rows, start=1):
+            lossy = [row[i] for i in id_columns if row[i] is not None and not row[i].isdigit()]
+            if lossy:
+                self.stats['unmatchable_ids'] += 1
+                self._logger.warning(f"{csv_path} row {number}: ids {lossy} lost digits in a float column")
+        if self.stats['unmatchable_ids']:
+            self._logger.warning(f"{self.stats['unmatchable_ids']} of {len(rows)} rows of {csv_path} "
+                                 f"imported with ids that cannot be matched")
+        placeholders = ', '.join('?' * len(LEDGER_COLUMNS))
+        with self._lock:
+            self._conn.executemany(
+                f"INSERT INTO trades ({', '.join(LEDGER_COLUMNS)}) VALUES ({placeholders})", rows)
+            self._conn.commit()
+        return len(rows)
+
+    def _insert(self, trade):
+        cols = [col for col in LEDGER_COLUMNS if col in trade]
+        cur = self._conn.execute(
+            f"INSERT INTO trades ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+            [trade[col] for col in cols])
+        return cur.lastrowid
+
+    def _exists(self, column, order_id):
+        return self._conn.execute(
+            f'SELECT 1 FROM trades WHERE {column} = ? LIMIT 1', (order_id,)).fetchone() is not None
+
+    def _exists_in_history(self, column, order_id):
+        for path in self._history_paths:
+            if not os.path.isfile(path):
+                continue
+            conn = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True)
+            try:
+                if conn.execute(f'SELECT 1 FROM trades WHERE {column} = ? LIMIT 1', (order_id,)).fetchone():
+                    return True
+            finally:
+                conn.close()
+        return False
+
+    def log_buy(self, trade):
+        # returns the new rowid, or None when the Buy_ID was already logged (e.g. a redelivered fill)
+        buy_id = str(trade['Buy_ID'])
+        with self._lock:
+            if self._exists('Buy_ID', buy_id):
+                self.stats['duplicate_buy_ids'] += 1
+                return None
+            row_id = self._insert(dict(trade, Buy_ID=buy_id))
+            self._conn.commit()
+        return row_id
+
+    def log_sell(self, buy_id, trade, replayed=False):
+        # close the round trip opened by buy_id and return MATCHED; a sell without an open buy is
+        # appended as a sell-only row (ORPHANED) unless that sell was already recorded (DUPLICATE)
+        buy_id = str(buy_id)
+        with self._lock:
+            row_id = self._open_row(buy_id)
+            if row_id is not None:
+                # HashKey charges the buy commission in the base asset, valued here at the buy price
+                self._conn.execute(
+                    f"UPDATE trades SET {', '.join(f'{col} = ?' for col in SELL_COLUMNS)}, "
+                    f"P_L = ? - Buy_Total - COALESCE(Buy_Fee, 0) * Buy_Price - ? WHERE rowid = ?",
+                    [trade.get(col) for col in SELL_COLUMNS]
+                    + [float(trade.get('Sell_Total') or 0), float(trade.get('Sell_Fee') or 0), row_id])
+                status = MATCHED
+            elif self._exists('Sell_ID', buy_id) or (replayed and self._exists_in_history('Sell_ID', buy_id)):
+                self.stats['replayed_duplicates' if replayed else 'duplicate_sells'] += 1
+                return DUPLICATE
+            else:
+                self._insert(trade)
+                self.stats['orphaned_sells'] += 1
+                status = ORPHANED
+            self._conn.commit()
+        return status
+
+    def is_duplicate_buy(self, buy_id, replayed=False):
+        # checked before acting on a buy fill, a known Buy_ID is counted as a duplicate
+        buy_id = str(buy_id)
+        with self._lock:
+            if self._exists('Buy_ID', buy_id):
+                self.stats['replayed_duplicates' if replayed else 'duplicate_buy_ids'] += 1
+                return True
+        if replayed and self._exists_in_history('Buy_ID', buy_id):
+            # logged (and its sell placed) by the partition that traded the symbol before
+            with self._lock:
+                self.stats['replayed_duplicates'] += 1
+            return True
+        return False
+
+    def count(self):
+        with self._lock:
+            total = self._conn.execute('SELECT COUNT(*) FROM trades').fetchone()[0]
+            open_buys = self._conn.execute(
+                f'SELECT COUNT(*) FROM trades INDEXED BY idx_trades_open WHERE {OPEN_BUY}').fetchone()[0]
+            return total, open_buys
+
+    def _read_connection(self):
+        # call with self._reader_lock held
+        if self._reader is None:
+            self._reader = sqlite3.connect(f"file:{os.path.abspath(self._db_path)}?mode=ro", uri=True,
+                                           check_same_thread=False)
+        return self._reader
+
+    def summary(self):
+        # per symbol round trips, realized P&L and the quote still tied up in open buys
+        with self._reader_lock:
+            rows = self._read_connection().execute(
+                'SELECT Symbol, COUNT(P_L), COALESCE(SUM(P_L), 0), '
+                'COUNT(CASE WHEN Sell_ID IS NULL THEN 1 END), '
+                'COALESCE(SUM(CASE WHEN Sell_ID IS NULL THEN Buy_Total END), 0) '
+                'FROM trades WHERE Buy_ID IS NOT NULL GROUP BY Symbol').fetchall()
+        return {symbol: {'closed': closed, 'realized': realized, 'open': open_buys, 'open_cost': open_cost}
+                for symbol, closed, realized, open_buys, open_cost in rows}
+
+    def adopt_open_buys(self, source_path, symbols):
+        # Move the open buys of symbols out of another ledger file into this one, e.g. when the
+        # symbols were handed to another worker. Closed history stays where it is. Buy_IDs this
+        # ledger already holds are skipped, so an interrupted move is completed by running it again.
+        symbols = list(symbols)
+        if not symbols or not os.path.isfile(source_path):
+            return 0
+        where = f"{OPEN_BUY} AND Symbol IN ({', '.join('?' * len(symbols))})"
+        columns = ', '.join(LEDGER_COLUMNS)
+        with self._lock:
+            self._conn.execute('ATTACH DATABASE ? AS source', (source_path,))
+            try:
+                moved = self._conn.execute(
+                    f"INSERT INTO trades ({columns}) SELECT {columns} FROM source.trades WHERE {where} "
+                    f"AND Buy_ID NOT IN (SELECT Buy_ID FROM main.trades WHERE Buy_ID IS NOT NULL) "
+                    f"ORDER BY rowid", symbols).rowcount
+                self._conn.commit()
+                self._conn.execute(f"DELETE FROM source.trades WHERE {where}", symbols)
+                self._conn.commit()
+            finally:
+                self._conn.execute('DETACH DATABASE source')
+        return moved
+
+    def to_frame(self):
+        # materialise the current view for reporting, column layout matches trade_data.csv
+        import pandas as pd
+        with self._reader_lock:
+            return pd.read_sql_query(
+                f"SELECT {', '.join(LEDGER_COLUMNS)} FROM trades ORDER BY rowid", self._read_connection())
+
+    def close(self):
+        with self._reader_lock:
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+        with self._lock:
+            self._conn.close()
+
+
+def _normalise_id(value):
+    # pandas wrote ids of columns holding NaN as floats: '1470709145387565.0' while the float still
+    # holds every digit, which is repaired here, but '1.4707091453875658e+18' for longer ids, which
+    # cannot be (see import_csv)
+    if not value:
+        return None
+    return value[:-2] if value.endswith('.0') else value
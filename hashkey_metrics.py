@@ -0,0 +1,173 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# latency buckets in seconds, from sub-millisecond parsing up to slow REST round trips
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    # fixed-bucket histogram, observe is a bisect and three adds under a lock
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self._sum = 0.0
+        self._count = 0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+            self._count += 1
+            if value > self._max:
+                self._max = value
+
+    def snapshot(self):
+        with self._lock:
+            return list(self._counts), self._sum, self._count, self._max
+
+    def quantile(self, q, snapshot=None):
+        # upper bound of the bucket holding the q-quantile (the max for the overflow bucket)
+        counts, _, count, max_value = snapshot or self.snapshot()
+        if not count:
+            return None
+        rank, seen = q * count, 0
+        for bound, n in zip(self.buckets, counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, max_value)
+        return max_value
+
+
+class Metrics:
+    # Timings of the bot's hot paths as histograms, plus counters and the stats dicts of the
+    # other components as gauges. Exported in the Prometheus text format over a local HTTP
+    # endpoint (serve) and summarised for the periodic stats log (summary).
+    def __init__(self, prefix='hashkey_bot', buckets=DEFAULT_BUCKETS):
+        self.prefix = prefix
+        self.buckets = buckets
+        self.histograms = {}
+        self.counters = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._logger = logging.getLogger(__name__)
+
+    def observe(self, name, seconds):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, Histogram(self.buckets))
+        histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def register(self, name, stats_func):
+        # stats_func returns a (nested) dict of numbers, read at export time
+        self._gauges[name] = stats_func
+
+    def summary(self):
+        # {name: {count, mean_ms, p50_ms, p99_ms, max_ms}} for logging
+        out = {}
+        for name, histogram in list(self.histograms.items()):
+            snap = histogram.snapshot()
+            counts, total, count, max_value = snap
+            if count:
+                out[name] = {
+                    'count': count,
+                    'mean_ms': round(total / count * 1000, 3),
+                    'p50_ms': round(histogram.quantile(0.5, snap) * 1000, 3),
+                    'p99_ms': round(histogram.quantile(0.99, snap) * 1000, 3),
+                    'max_ms': round(max_value * 1000, 3),
+                }
+        return out
+
+    def render(self):
+        lines = []
+        for name, histogram in sorted(self.histograms.items()):
+            counts, total, count, _ = histogram.snapshot()
+            metric = f"{self.prefix}_{name}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, n in zip(histogram.buckets, counts):
+                cumulative += n
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{le="+Inf"}} {count}')
+            lines.append(f"{metric}_sum {total}")
+            lines.append(f"{metric}_count {count}")
+        with self._lock:
+            counters = dict(self.counters)
+        for name, value in sorted(counters.items()):
+            lines.append(f"# TYPE {self.prefix}_{name}_total counter")
+            lines.append(f"{self.prefix}_{name}_total {value}")
+        for name, stats_func in sorted(self._gauges.items()):
+            try:
+                stats = stats_func()
+            except Exception as e:
+                self._logger.error(f"Metrics source {name} failed: {e}")
+                continue
+            for key, value in _flatten(stats, f"{self.prefix}_{name}"):
+                lines.append(f"{key} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        # /metrics on a daemon thread, bound to localhost unless told otherwise
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='metrics', daemon=True).start()
+        self._logger.info(f"Metrics endpoint on http://{host}:{self._server.server_port}/metrics")
+        return self._server
+
+    def close(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def _flatten(stats, prefix):
+    if isinstance(stats, dict):
+        for key, value in stats.items():
+            yield from _flatten(value, f"{prefix}_{_metric_name(key)}")
+    elif isinstance(stats, bool):
+        yield prefix, int(stats)
+    elif isinstance(stats, (int, float)):
+        yield prefix, stats
+
+
+def _metric_name(key):
+    return ''.join(c if c.isalnum() else '_' for c in str(key)).strip('_').lower()
@@ -0,0 +1,167 @@
+import logging
+import queue
+import threading
+import time
+
+_STOP = object()
+
+
+class KeyedStage:
+    # A pool of worker threads, each draining its own bounded queue. Items are routed by key
+    # (the symbol), so all items for one symbol are handled by one worker in arrival order while
+    # different symbols proceed in parallel. A full queue blocks the producer: that is the
+    # backpressure, and every wait is counted in the stage metrics. A producer that must not
+    # block (the event loop) puts with block=False and hands refused items to a thread.
+    def __init__(self, name, handler, workers=2, maxsize=1000):
+        self.name = name
+        self._handler = handler
+        self._queues = [queue.Queue(maxsize=maxsize) for _ in range(workers)]
+        self._threads = []
+        self._lock = threading.Lock()
+        self._logger = logging.getLogger(__name__)
+        self.metrics = {
+            'submitted': 0,
+            'processed': 0,
+            'errors': 0,
+            'max_depth': 0,
+            'backpressure_waits': 0,
+            'backpressure_s': 0.0,
+            'queue_wait_s': 0.0,
+            'max_queue_wait_s': 0.0,
+        }
+
+    def start(self):
+        if self._threads:
+            return
+        for i, q in enumerate(self._queues):
+            thread = threading.Thread(target=self._run, args=(q,), name=f"{self.name}-{i}")
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def put(self, key, item, block=True):
+        # returns False, with nothing queued, when the queue is full and block is False
+        q = self._queues[hash(key) % len(self._queues)]
+        entry = (item, time.perf_counter())
+        try:
+            q.put_nowait(entry)
+            waited = 0.0
+        except queue.Full:
+            if not block:
+                return False
+            start = time.perf_counter()
+            q.put(entry)
+            waited = time.perf_counter() - start
+        with self._lock:
+            self.metrics['submitted'] += 1
+            self.metrics['max_depth'] = max(self.metrics['max_depth'], q.qsize())
+            if waited:
+                self.metrics['backpressure_waits'] += 1
+                self.metrics['backpressure_s'] += waited
+        return True
+
+    def _run(self, q):
+        while True:
+            entry = q.get()
+            if entry is _STOP:
+                q.task_done()
+                break
+            item, enqueued = entry
+            wait = time.perf_counter() - enqueued
+            try:
+                self._handler(item)
+                failed = 0
+            except Exception as e:
+                failed = 1
+                self._logger.error(f"{self.name} stage error processing {item}: {e}")
+            finally:
+                q.task_done()
+            with self._lock:
+                self.metrics['processed'] += 1
+                self.metrics['errors'] += failed
+                self.metrics['queue_wait_s'] += wait
+                self.metrics['max_queue_wait_s'] = max(self.metrics['max_queue_wait_s'], wait)
+
+    def join(self):
+        # block until everything queued so far has been handled
+        for q in self._queues:
+            q.join()
+
+    def stop(self, timeout=None):
+        # Lets the workers finish what is queued, at most for timeout seconds; items still queued
+        # then are dropped and returned (the item a worker is busy with is finished regardless).
+        deadline = None if timeout is None else time.monotonic() + timeout
+        dropped = []
+        for q in self._queues:
+            try:
+                q.put(_STOP, timeout=self._remaining(deadline))
+            except queue.Full:
+                dropped += self._discard(q)
+        for thread in self._threads:
+            thread.join(self._remaining(deadline))
+        for q, thread in zip(self._queues, self._threads):
+            if thread.is_alive():
+                dropped += self._discard(q)
+        self._threads = []
+        if dropped:
+            self._logger.error(f"{self.name} stage stopped with {len(dropped)} items unhandled")
+        return dropped
+
+    @staticmethod
+    def _remaining(deadline):
+        return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+    @staticmethod
+    def _discard(q):
+        # empty the queue and leave only the stop marker, for the worker to exit after its current item
+        items = []
+        while True:
+            try:
+                entry = q.get_nowait()
+            except queue.Empty:
+                break
+            q.task_done()
+            if entry is not _STOP:
+                items.append(entry[0])
+        q.put_nowait(_STOP)
+        return items
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.metrics)
+        stats['depth'] = sum(q.qsize() for q in self._queues)
+        return stats
+
+
+class FillPipeline:
+    # receive (websocket thread) -> fill queue -> fill workers -> order queue -> order workers
+    # Fill workers do the ledger bookkeeping and hand follow-up orders to a separate stage,
+    # so REST round trips never wait on ledger I/O and vice versa.
+    def __init__(self, fill_handler, order_handler, fill_workers=2, order_workers=2, maxsize=1000):
+        self.fills = KeyedStage('fills', fill_handler, fill_workers, maxsize)
+        self.orders = KeyedStage('orders', order_handler, order_workers, maxsize)
+
+    def start(self):
+        self.orders.start()
+        self.fills.start()
+
+    def submit_fill(self, order, block=True):
+        return self.fills.put(order['s'], order, block)
+
+    def submit_order(self, params):
+        self.orders.put(params['symbol'], params)
+
+    def join(self):
+        # fills first, they may still enqueue orders
+        self.fills.join()
+        self.orders.join()
+
+    def stop(self, timeout=None):
+        # fills first, they may still enqueue orders; returns what was dropped when the timeout ran out
+        deadline = None if timeout is None else time.monotonic() + timeout
+        fills = self.fills.stop(timeout)
+        orders = self.orders.stop(KeyedStage._remaining(deadline))
+        return {'fills': fills, 'orders': orders}
+
+    def stats(self):
+        return {'fills': self.fills.stats(), 'orders': self.orders.stats()}
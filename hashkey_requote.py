@@ -0,0 +1,72 @@
+from collections import deque
+
+
+class RequoteScheduler:
+    # Tracks the live buy order of every pair and decides when it has to be replaced: when the
+    # target price moved outside the tolerance band (relative to the live price) or the order
+    # is older than max_age_s. Everything else keeps its place in the queue.
+    # A pair whose re-quote failed (order rejected, cancel outcome unknown) is not due again
+    # before a backoff from retry_min_s doubling up to retry_max_s (default max_age_s) ran out,
+    # so e.g. an insufficient balance does not spend the shared REST budget on every depth update.
+    def __init__(self, tolerance, max_age_s, retry_min_s=1.0, retry_max_s=None):
+        self.tolerance = tolerance  # pair -> relative band, e.g. 0.001 for 10bps
+        self.max_age_s = max_age_s
+        self.retry_min_s = retry_min_s
+        self.retry_max_s = retry_max_s if retry_max_s is not None else max(retry_min_s, max_age_s)
+        self.live = {}  # pair -> {'order_id', 'price', 'placed_at'}
+        # orders reported closed before their placement response came back
+        self._closed = deque(maxlen=1000)
+        self._retry = {}  # pair -> (consecutive failures, time before which it is not due)
+        self.stats = {'placed': 0, 'price_moves': 0, 'aged_out': 0, 'closed': 0, 'failed': 0}
+
+    def needs_requote(self, pair, price, now):
+        retry = self._retry.get(pair)
+        if retry is not None and now < retry[1]:
+            return None
+        live = self.live.get(pair)
+        if live is None:
+            return 'no_order'
+        if abs(price - live['price']) > live['price'] * self.tolerance[pair]:
+            return 'price'
+        if now - live['placed_at'] > self.max_age_s:
+            return 'age'
+        return None
+
+    def due(self, prices, now):
+        # pair -> reason for every pair that should be re-quoted
+        due = {}
+        for pair, price in prices.items():
+            reason = self.needs_requote(pair, price, now)
+            if reason:
+                due[pair] = reason
+        self.stats['price_moves'] += sum(1 for reason in due.values() if reason == 'price')
+        self.stats['aged_out'] += sum(1 for reason in due.values() if reason == 'age')
+        return due
+
+    def placed(self, pair, order_id, price, now):
+        self._retry.pop(pair, None)
+        if str(order_id) in self._closed:
+            return
+        self.live[pair] = {'order_id': str(order_id), 'price': price, 'placed_at': now}
+        self.stats['placed'] += 1
+
+    def closed(self, pair, order_id):
+        # the order filled, was cancelled or rejected
+        order_id = str(order_id)
+        live = self.live.get(pair)
+        if live is not None and live['order_id'] == order_id:
+            del self.live[pair]
+        else:
+            self._closed.append(order_id)
+        self.stats['closed'] += 1
+
+    def failed(self, pair, now):
+        # the re-quote did not place an order, returns the backoff before the pair is due again
+        failures = self._retry.get(pair, (0, now))[0] + 1
+        backoff = min(self.retry_max_s, self.retry_min_s * 2 ** (failures - 1))
+        self._retry[pair] = (failures, now + backoff)
+        self.stats['failed'] += 1
+        return backoff
+
+    def cancelled(self, pair):
+        self.live.pop(pair, None)
@@ -0,0 +1,150 @@
+import logging
+import random
+import threading
+import time
+import urllib.parse
+from collections import defaultdict, deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from signing import HashKeySigner
+
+BASE_URL = "https://api-pro.hashkey.com"
+
+# (connect, read) timeouts in seconds, order placement is kept tight for the re-quote loop
+DEFAULT_TIMEOUT = (3, 10)
+ENDPOINT_TIMEOUTS = {
+    '/api/v1/spot/order': (2, 5),
+    '/api/v1/spot/openOrders': (2, 5),
+    '/api/v1/userDataStream': (3, 10),
+    '/quote/v1/ticker/bookTicker': (2, 3),
+}
+
+# statuses the exchange uses for "not processed, try again later"
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# a POST that may have reached the matching engine is not resent, only rate limited ones are:
+# a 503 from the gateway can still come with the order placed
+SAFE_POST_RETRY_STATUS = {429}
+
+
+class HashKeyRestClient:
+    # One pooled keep-alive session shared by every REST call of the bot. Adds per-endpoint
+    # timeouts, retries with jittered backoff on transient errors, a client side request rate
+    # cap plus Retry-After handling on 429, and records the latency of every request.
+    def __init__(self, user_key, user_secret, base_url=BASE_URL, timeouts=None, max_retries=2,
+                 backoff_s=0.2, max_requests_per_s=None, pool_size=10):
+        self.user_key = user_key
+        self._signer = HashKeySigner(user_secret)
+        self.base_url = base_url.rstrip('/')
+        self.timeouts = dict(ENDPOINT_TIMEOUTS, **(timeouts or {}))
+        self.max_retries = max_retries
+        self.backoff_s = backoff_s
+        self._logger = logging.getLogger(__name__)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'accept': 'application/json'})
+        self._auth_headers = {
+            'X-HK-APIKEY': self.user_key,
+            'content-type': 'application/x-www-form-urlencoded;charset=UTF-8',
+        }
+
+        self._rate_lock = threading.Lock()
+        self._min_interval = 1 / max_requests_per_s if max_requests_per_s else 0
+        self._next_slot = 0.0
+        self._blocked_until = 0.0
+
+        self._stats_lock = threading.Lock()
+        self.latency = defaultdict(lambda: deque(maxlen=1000))
+        self.counters = defaultdict(int)
+
+    def signed_request(self, method, path, params):
+        return self._request(method, path, dict(params), signed=True)
+
+    def public_request(self, method, path, params=None):
+        return self._request(method, path, dict(params or {}), signed=False)
+
+    def _throttle(self):
+        # reserve the next send slot under the lock, then sleep outside it
+        with self._rate_lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot, self._blocked_until)
+            self._next_slot = slot + self._min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def _backoff(self, attempt):
+        # full jitter so concurrent callers do not retry in lockstep
+        time.sleep(random.uniform(0, self.backoff_s * 2 ** attempt))
+
+    def _record(self, key, elapsed, outcome):
+        with self._stats_lock:
+            self.latency[key].append(elapsed)
+            self.counters[f"{key} {outcome}"] += 1
+
+    def _request(self, method, path, params, signed):
+        key = f"{method} {path}"
+        url = self.base_url + path
+        timeout = self.timeouts.get(path, DEFAULT_TIMEOUT)
+        retry_status = SAFE_POST_RETRY_STATUS if method == 'POST' else RETRY_STATUS
+        headers = self._auth_headers if signed else None
+
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            if signed:
+                # re-sign every attempt so a retried request carries a fresh timestamp
+                if 'timestamp' in params:
+                    params['timestamp'] = int(time.time() * 1000)
+                payload = self._signer.signed_payload(params)
+            else:
+                payload = urllib.parse.urlencode(params)
+            # the encoded payload goes out as is, so the signed bytes are the bytes sent
+            if method == 'GET':
+                request_url, body = (f"{url}?{payload}" if payload else url), None
+            else:
+                request_url, body = url, payload
+
+            self._throttle()
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, request_url, headers=headers, data=body, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._record(key, time.perf_counter() - start, type(e).__name__)
+                # a read timeout on a POST may still have placed the order, never resend it
+                unsent = isinstance(e, requests.ConnectTimeout)
+                if last_attempt or (method == 'POST' and not unsent):
+                    raise
+                self._logger.warning(f"{key} failed ({e}), retry {attempt + 1}/{self.max_retries}")
+                self._backoff(attempt)
+                continue
+
+            self._record(key, time.perf_counter() - start, response.status_code)
+            if response.status_code == 429:
+                retry_after = float(response.headers.get('Retry-After', 1))
+                with self._rate_lock:
+                    self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+                self._logger.warning(f"{key} rate limited, backing off {retry_after}s")
+            if response.status_code in retry_status and not last_attempt:
+                self._backoff(attempt)
+                continue
+            return response
+
+    def latency_stats(self):
+        stats = {}
+        with self._stats_lock:
+            samples = {key: sorted(values) for key, values in self.latency.items()}
+        for key, values in samples.items():
+            if values:
+                stats[key] = {
+                    'count': len(values),
+                    'p50_ms': round(values[len(values) // 2] * 1000, 2),
+                    'p99_ms': round(values[min(len(values) - 1, int(len(values) * 0.99))] * 1000, 2),
+                    'max_ms': round(values[-1] * 1000, 2),
+                }
+        return stats
+
+    def close(self):
+        self.session.close()
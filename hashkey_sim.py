@@ -0,0 +1,519 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import websockets
+
+# Local stand-in for the HashKey endpoints WebSocketClient uses: the REST calls (userDataStream,
+# spot/order, spot/openOrders, bookTicker, order/trade history), the private stream with
+# executionReports and the public depth stream, backed by a small matching engine. Used to
+# load-test the bot on one box: synthetic buy fills are pushed at a fixed rate and the time from
+# each fill to the follow-up sell order reaching the "exchange" is measured.
+#
+#   python hashkey_sim.py --symbols 4 --fill-rate 50 --duration 20
+#   python hashkey_sim.py --fill-rate 200 --rest-rate 1000 --fill-workers 4 --order-workers 8
+#   python hashkey_sim.py --symbols 8 --fill-rate 200 --rest-rate 1000 --shards 4   # hashkey_supervisor workers
+#   python hashkey_sim.py --serve --http-port 18081 --ws-port 18082   # for a bot started by hand
+
+FEE_RATE = 0.001
+
+
+class MatchingEngine:
+    # One account, one best bid/ask per symbol moved by a random walk. Resting limit orders fill
+    # in full at their limit price once the other side of the book crosses them, market orders
+    # fill at once. Every state change is published as an executionReport.
+    def __init__(self, symbols, start_price=30000.0, spread=0.0002, volatility=0.0005, seed=None):
+        self.symbols = list(symbols)
+        self.spread = spread
+        self.volatility = volatility
+        self.mid = {symbol: start_price for symbol in self.symbols}
+        self.orders = {}  # live orders by orderId
+        self.closed = []  # closed orders, for the history endpoints
+        self.trades = []
+        self.listeners = []  # called with each executionReport
+        self._ids = itertools.count(10 ** 15)
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self.stats = {'placed': 0, 'cancelled': 0, 'filled': 0, 'synthetic_fills': 0, 'rejected': 0}
+
+    def book(self, symbol):
+        mid = self.mid[symbol]
+        return round(mid * (1 - self.spread / 2), 2), round(mid * (1 + self.spread / 2), 2)
+
+    def book_ticker(self):
+        now = int(time.time() * 1000)
+        with self._lock:
+            return [{'s': s, 'b': str(b), 'bq': '1', 'a': str(a), 'aq': '1', 't': now}
+                    for s, (b, a) in ((s, self.book(s)) for s in self.symbols)]
+
+    def tick(self):
+        # move every mid and match what crossed, returns the books after the move
+        with self._lock:
+            for symbol in self.symbols:
+                self.mid[symbol] *= 1 + self._random.gauss(0, self.volatility)
+            for order in list(self.orders.values()):
+                bid, ask = self.book(order['symbol'])
+                price = float(order['price'])
+                if (order['side'] == 'BUY' and ask <= price) or (order['side'] == 'SELL' and bid >= price):
+                    self._fill(order, price)
+            return {symbol: self.book(symbol) for symbol in self.symbols}
+
+    def place(self, params):
+        with self._lock:
+            symbol = params.get('symbol')
+            side = str(params.get('side', '')).upper()
+            order_type = str(params.get('type', '')).upper()
+            if symbol not in self.mid or side not in ('BUY', 'SELL') or order_type not in ('LIMIT', 'MARKET'):
+                self.stats['rejected'] += 1
+                return None
+            bid, ask = self.book(symbol)
+            order = {
+                'orderId': str(next(self._ids)),
+                'clientOrderId': params.get('newClientOrderId') or f"sim{time.time_ns()}",
+                'symbol': symbol,
+                'side': side,
+                'type': order_type,
+                'price': str(params.get('price') or (ask if side == 'BUY' else bid)),
+                'origQty': str(params.get('quantity')),
+                'executedQty': '0',
+                'cummulativeQuoteQty': '0',
+                'status': 'NEW',
+                'time': int(time.time() * 1000),
+                'updateTime': int(time.time() * 1000),
+            }
+            if order_type == 'MARKET' and side == 'BUY':
+                # v1 api - quantity is the quote amount for market buys
+                order['origQty'] = str(round(float(params.get('quantity')) / ask, 8))
+            self.orders[order['orderId']] = order
+            self.stats['placed'] += 1
+            self._publish(order)
+            if order_type == 'MARKET':
+                self._fill(order, ask if side == 'BUY' else bid)
+            return order
+
+    def cancel(self, order_id):
+        with self._lock:
+            order = self.orders.pop(str(order_id), None)
+            if order is not None:
+                self._close(order, 'CANCELED')
+                self.stats['cancelled'] += 1
+            return order
+
+    def cancel_all(self, symbol=None, side=None):
+        with self._lock:
+            matching = [o['orderId'] for o in self.orders.values()
+                        if (symbol is None or o['symbol'] == symbol) and (side is None or o['side'] == side)]
+            return [self.cancel(order_id) for order_id in matching]
+
+    def open_orders(self, symbol=None):
+        with self._lock:
+            return [dict(o) for o in self.orders.values() if symbol is None or o['symbol'] == symbol]
+
+    def fill(self, order_id):
+        # fill a resting order now, whatever the book
+        with self._lock:
+            order = self.orders.get(str(order_id))
+            if order is not None:
+                self._fill(order, float(order['price']))
+            return order
+
+    def synthetic_buy_fill(self, symbol, quantity='0.001'):
+        # a limit buy at the bid that fills immediately, as if it had been resting
+        with self._lock:
+            bid, _ = self.book(symbol)
+            order = self.place({'symbol': symbol, 'side': 'BUY', 'type': 'LIMIT', 'price': round(bid),
+                                'quantity': quantity})
+            self.stats['synthetic_fills'] += 1
+            self._fill(order, float(order['price']))
+            return order
+
+    def _fill(self, order, price):
+        qty = float(order['origQty'])
+        order['executedQty'] = order['origQty']
+        order['cummulativeQuoteQty'] = str(round(qty * price, 8))
+        # commission in the asset received, base for buys and quote for sells
+        fee = qty * FEE_RATE if order['side'] == 'BUY' else qty * price * FEE_RATE
+        self.trades.append({'orderId': order['orderId'], 'symbol': order['symbol'], 'price': str(price),
+                            'qty': order['origQty'], 'commission': str(round(fee, 10)),
+                            'time': int(time.time() * 1000)})
+        self.orders.pop(order['orderId'], None)
+        self.stats['filled'] += 1
+        self._close(order, 'FILLED', fee)
+
+    def _close(self, order, status, fee=0.0):
+        order['status'] = status
+        order['updateTime'] = int(time.time() * 1000)
+        self.closed.append(order)
+        self._publish(order, fee)
+
+    def _publish(self, order, fee=0.0):
+        report = {
+            'e': 'executionReport',
+            'E': order['updateTime'],
+            's': order['symbol'],
+            'c': order['clientOrderId'],
+            'S': order['side'],
+            'o': order['type'],
+            'q': order['origQty'],
+            'p': order['price'],
+            'X': order['status'],
+            'i': order['orderId'],
+            'z': order['executedQty'],
+            'Z': order['cummulativeQuoteQty'],
+            'n': str(round(fee, 10)),
+        }
+        for listener in self.listeners:
+            listener(report)
+
+    def history(self, start_ms=0, end_ms=None, limit=1000):
+        end_ms = end_ms or int(time.time() * 1000)
+        with self._lock:
+            orders = [dict(o) for o in self.closed if start_ms <= o['updateTime'] <= end_ms]
+            trades = [dict(t) for t in self.trades if start_ms <= t['time'] <= end_ms]
+        return orders[-limit:], trades[-limit:]
+
+
+class HashKeySimulator:
+    # REST on a threaded HTTP server, both websocket streams on an event loop in a background
+    # thread. Signatures are not checked. Optionally fills the bot's follow-up sells after
+    # sell_fill_delay_s so the ledger sees complete round trips.
+    def __init__(self, engine, http_port=0, ws_port=0, tick_s=0.1, sell_fill_delay_s=None):
+        self.engine = engine
+        self.tick_s = tick_s
+        self.sell_fill_delay_s = sell_fill_delay_s
+        self.fill_sent = {}  # buy orderId -> perf_counter when its fill report was queued
+        self.sell_latency = []  # fill report -> matching sell order received
+        self.requests = {}
+        self._http_port = http_port
+        self._ws_port = ws_port
+        self._private = set()
+        self._public = set()
+        self._loop = None
+        self._ready = threading.Event()
+        self._stop = None
+        self._lock = threading.Lock()
+        self._logger = logging.getLogger(__name__)
+        engine.listeners.append(self._on_report)
+
+    @property
+    def rest_url(self):
+        return f"http://127.0.0.1:{self._http.server_port}"
+
+    @property
+    def stream_url(self):
+        return f"ws://127.0.0.1:{self._ws_port}"
+
+    def start(self):
+        self._http = ThreadingHTTPServer(('127.0.0.1', self._http_port), self._handler_class())
+        self._http.daemon_threads = True
+        threading.Thread(target=self._http.serve_forever, name='sim-http', daemon=True).start()
+        threading.Thread(target=lambda: asyncio.run(self._serve()), name='sim-ws', daemon=True).start()
+        self._ready.wait(5)
+        return self
+
+    def stop(self):
+        self._http.shutdown()
+        self._http.server_close()
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+    # --- websocket side
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        async with websockets.serve(self._ws_handler, '127.0.0.1', self._ws_port) as server:
+            self._ws_port = server.sockets[0].getsockname()[1]
+            ticker = asyncio.create_task(self._tick_loop())
+            self._ready.set()
+            await self._stop.wait()
+            ticker.cancel()
+
+    async def _ws_handler(self, ws):
+        private = ws.request.path.startswith('/api/v1/ws/')
+        queue = asyncio.Queue()
+        clients = self._private if private else self._public
+        clients.add(queue)
+        sender = asyncio.create_task(self._sender(ws, queue))
+        try:
+            async for message in ws:
+                data = json.loads(message)
+                if 'ping' in data:
+                    queue.put_nowait(json.dumps({'pong': data['ping']}))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            clients.discard(queue)
+            sender.cancel()
+
+    async def _sender(self, ws, queue):
+        while True:
+            await ws.send(await queue.get())
+
+    async def _tick_loop(self):
+        version = 0
+        while True:
+            await asyncio.sleep(self.tick_s)
+            books = self.engine.tick()
+            version += 1
+            now = int(time.time() * 1000)
+            for symbol, (bid, ask) in books.items():
+                message = json.dumps({'symbol': symbol, 'topic': 'depth', 'data': [
+                    {'s': symbol, 't': now, 'v': f"{version}_1", 'b': [[str(bid), '1']], 'a': [[str(ask), '1']]}]})
+                for queue in list(self._public):
+                    queue.put_nowait(message)
+
+    def _on_report(self, report):
+        # engine thread (HTTP handler or tick) -> private stream queues on the loop
+        if report['X'] == 'FILLED' and report['S'] == 'BUY':
+            with self._lock:
+                self.fill_sent[report['i']] = time.perf_counter()
+        message = json.dumps([report])
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._push_private, message)
+
+    def _push_private(self, message):
+        for queue in list(self._private):
+            queue.put_nowait(message)
+
+    def load(self, fill_rate, symbols=None):
+        # synthetic buy fills at fill_rate per second, spread round robin over the symbols
+        symbols = itertools.cycle(symbols or self.engine.symbols)
+
+        async def generate():
+            interval, owed = 0.005, 0.0
+            next_at = time.perf_counter()
+            while True:
+                owed += fill_rate * interval
+                for _ in range(int(owed)):
+                    self.engine.synthetic_buy_fill(next(symbols))
+                owed -= int(owed)
+                next_at += interval
+                await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+
+        return asyncio.run_coroutine_threadsafe(generate(), self._loop)
+
+    # --- REST side
+
+    def _on_sell(self, order):
+        with self._lock:
+            sent = self.fill_sent.pop(order['clientOrderId'], None)
+            if sent is not None:
+                self.sell_latency.append(time.perf_counter() - sent)
+        if self.sell_fill_delay_s is not None:
+            self._loop.call_soon_threadsafe(self._loop.call_later, self.sell_fill_delay_s, self.engine.fill,
+                                            order['orderId'])
+
+    def handle(self, method, path, params):
+        key = f"{method} {path}"
+        with self._lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+        engine = self.engine
+        if path == '/api/v1/userDataStream':
+            return 200, {'listenKey': 'simListenKey'} if method == 'POST' else {}
+        if path == '/quote/v1/ticker/bookTicker':
+            return 200, engine.book_ticker()
+        if path == '/api/v1/spot/order':
+            if method == 'POST':
+                order = engine.place(params)
+                if order is None:
+                    return 400, {'code': -1100, 'msg': 'Illegal parameter'}
+                if order['side'] == 'SELL' and params.get('newClientOrderId'):
+                    self._on_sell(order)
+                return 200, order
+            if method == 'DELETE':
+                order = engine.cancel(params.get('orderId'))
+                return (200, order) if order else (400, {'code': -2011, 'msg': 'Order not found'})
+        if path == '/api/v1/spot/openOrders':
+            if method == 'DELETE':
+                engine.cancel_all(params.get('symbol'), params.get('side'))
+                return 200, {'success': True}
+            return 200, engine.open_orders(params.get('symbol'))
+        if path in ('/api/v1/spot/tradeOrders', '/api/v1/account/trades'):
+            orders, trades = engine.history(int(params.get('startTime', 0)), int(params.get('endTime', 0)) or None,
+                                            int(params.get('limit', 1000)))
+            return 200, orders if path.endswith('tradeOrders') else trades
+        return 404, {'code': -1, 'msg': f"{method} {path} not simulated"}
+
+    def _handler_class(self):
+        sim = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _dispatch(self):
+                url = urllib.parse.urlsplit(self.path)
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode()
+                params = dict(urllib.parse.parse_qsl(url.query))
+                params.update(urllib.parse.parse_qsl(body))
+                status, payload = sim.handle(self.command, url.path, params)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _dispatch
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def latency_stats(self):
+        with self._lock:
+            values = sorted(self.sell_latency)
+            pending = len(self.fill_sent)
+        if not values:
+            return {'sells': 0, 'pending': pending}
+        return {
+            'sells': len(values),
+            'pending': pending,
+            'p50_ms': round(values[len(values) // 2] * 1000, 2),
+            'p99_ms': round(values[min(len(values) - 1, int(len(values) * 0.99))] * 1000, 2),
+            'max_ms': round(values[-1] * 1000, 2),
+        }
+
+
+BOT_CONFIG = """[DEFAULT]
+access = sim
+secret = sim
+trade_pairs = {pairs}
+dca_pairs = {first_pair}
+trade_interval_s = 5
+dca_hour = 0
+dca_minute = 0
+rest_url = {rest_url}
+stream_url = {stream_url}
+rest_max_requests_per_s = {rest_rate}
+pipeline_fill_workers = {fill_workers}
+pipeline_order_workers = {order_workers}
+reconcile_lookback_s = 0
+
+{sections}
+"""
+PAIR_SECTION = """[{pair}]
+buy_limit_margin = 0.99
+sell_limit_margin = 1.01
+trade_quantity = 0.001
+dca_amount = 10
+"""
+
+
+def run_load_test(args):
+    # simulator and bot in one process, the bot in a scratch directory with a generated config.
+    # With --shards the bot runs as hashkey_supervisor worker processes instead.
+    symbols = [f"SIM{i}USD" for i in range(args.symbols)]
+    sim = HashKeySimulator(MatchingEngine(symbols, seed=args.seed), sell_fill_delay_s=args.sell_fill_delay).start()
+    workdir = tempfile.mkdtemp(prefix='hashkey_sim_')
+    os.makedirs(os.path.join(workdir, 'config'))
+    os.makedirs(os.path.join(workdir, 'reports'))
+    config_path = os.path.join(workdir, 'config', 'config_hashkey.cfg')
+    with open(config_path, 'w') as f:
+        f.write(BOT_CONFIG.format(pairs=','.join(symbols), first_pair=symbols[0], rest_url=sim.rest_url,
+                                  stream_url=sim.stream_url, rest_rate=args.rest_rate,
+                                  fill_workers=args.fill_workers, order_workers=args.order_workers,
+                                  sections='\n'.join(PAIR_SECTION.format(pair=pair) for pair in symbols)))
+    os.chdir(workdir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    if args.shards > 1:
+        from hashkey_supervisor import Supervisor, plan_workers
+        supervisor = Supervisor(config_path, plan_workers(config_path, args.shards), status_interval_s=1)
+        bot = threading.Thread(target=supervisor.run, name='supervisor')
+        stop = supervisor.stop
+    else:
+        import hashkey_bot
+        from hashkey_config import load_config
+        config = load_config(config_path)
+        ledger = hashkey_bot.open_ledger(config)
+        client = hashkey_bot.WebSocketClient(config, ledger, ['depth'], symbols)
+        bot = threading.Thread(target=client.connect, name='bot')
+        stop = client.stop
+    bot.start()
+    time.sleep(args.warmup)
+    start = time.perf_counter()
+    load = sim.load(args.fill_rate)
+    time.sleep(args.duration)
+    load.cancel()
+    elapsed = time.perf_counter() - start
+    time.sleep(args.drain)
+    stop()
+    bot.join(20)
+    if bot.is_alive():
+        # still sending its backlog (bounded by shutdown_drain_s), the exchange has to stay up for it
+        print("bot still draining its queues, waiting for it to stop")
+        bot.join()
+    sim.stop()
+
+    stats = sim.latency_stats()
+    print(f"symbols {args.symbols}, target {args.fill_rate} fills/s for {args.duration}s, "
+          f"rest cap {args.rest_rate}/s, workers {args.fill_workers}/{args.order_workers}")
+    print(f"fills {sim.engine.stats['synthetic_fills']} ({sim.engine.stats['synthetic_fills'] / elapsed:.1f}/s), "
+          f"sells {stats['sells']} ({stats['sells'] / (elapsed + args.drain):.1f}/s), pending {stats['pending']}")
+    if stats['sells']:
+        print(f"fill -> sell order p50 {stats['p50_ms']} ms, p99 {stats['p99_ms']} ms, max {stats['max_ms']} ms")
+    print(f"engine {sim.engine.stats}")
+    if args.shards > 1:
+        for name, report in sorted(supervisor.status.items()):
+            fill = report['latency'].get('fill_handle', {})
+            print(f"worker {name}: pairs {','.join(report['pairs'])}, counters {report['counters']}, "
+                  f"fill_handle p99 {fill.get('p99_ms')} ms, ledger {report['pnl']}")
+        print(f"total {supervisor.aggregate()['all']}")
+    else:
+        print(f"ledger rows/open {ledger.count()}, stats {ledger.stats}")
+        print(f"bot latency {client.metrics.summary()}")
+        print(f"pipeline {client._pipeline.stats()}")
+    print(f"workdir {workdir}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local HashKey exchange simulator and bot load test')
+    parser.add_argument('--serve', action='store_true', help='only run the simulator, until interrupted')
+    parser.add_argument('--http-port', type=int, default=18081)
+    parser.add_argument('--ws-port', type=int, default=18082)
+    parser.add_argument('--symbols', type=int, default=2, help='number of simulated pairs')
+    parser.add_argument('--fill-rate', type=float, default=20, help='synthetic buy fills per second')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of load')
+    parser.add_argument('--warmup', type=float, default=2, help='seconds before the load starts')
+    parser.add_argument('--drain', type=float, default=2, help='seconds to let queued sells finish')
+    parser.add_argument('--sell-fill-delay', type=float, default=0.05,
+                        help='fill follow-up sells after this many seconds (negative: leave them resting)')
+    parser.add_argument('--rest-rate', type=float, default=10, help="bot's rest_max_requests_per_s")
+    parser.add_argument('--fill-workers', type=int, default=2)
+    parser.add_argument('--order-workers', type=int, default=4)
+    parser.add_argument('--shards', type=int, default=1, help='run the bot as this many supervised worker processes')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    if args.sell_fill_delay < 0:
+        args.sell_fill_delay = None
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.serve:
+        symbols = [f"SIM{i}USD" for i in range(args.symbols)]
+        sim = HashKeySimulator(MatchingEngine(symbols, seed=args.seed), http_port=args.http_port,
+                               ws_port=args.ws_port, sell_fill_delay_s=args.sell_fill_delay).start()
+        print(f"REST {sim.rest_url}, streams {sim.stream_url}, symbols {','.join(symbols)}")
+        if args.fill_rate:
+            sim.load(args.fill_rate)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            sim.stop()
+    else:
+        run_load_test(args)
+
+
+if __name__ == '__main__':
+    main()
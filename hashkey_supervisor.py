@@ -0,0 +1,291 @@
+import argparse
+import glob
+import logging
+import multiprocessing
+import os
+import queue
+import re
+import signal
+import threading
+import time
+
+from hashkey_config import CONFIG_PATH, DEFAULT_ACCOUNT, BotConfig, accounts, load_config, read_config
+from hashkey_ledger import TradeLedger
+
+# Runs the market maker as worker processes. Every account ([account:NAME] sections, or the
+# DEFAULT keys) is split into `shards` workers that each trade a round robin share of its pairs
+# with their own websockets, their own ledger partition and an equal share of the account's REST
+# request budget. Workers report health and P&L over a queue, the supervisor logs the aggregate
+# and restarts workers that die.
+#
+#   python hashkey_supervisor.py                  # shards per account from the config (default 1)
+#   python hashkey_supervisor.py --shards 4
+#   python hashkey_supervisor.py --accounts main,second --status-interval 10
+#
+# Ledger partitions sit next to the ledger_path, e.g. trade_data.main.0.db. Before the workers
+# start, open buys are moved to the partition of the worker that now trades their symbol, so
+# changing the shard count keeps every open round trip. hashkey_bot runs the --shards 1 plan of
+# its account with the same move, so going back to a single process keeps them too.
+
+
+def _suffixed(path, tag):
+    root, ext = os.path.splitext(path)
+    return f"{root}.{tag}{ext}"
+
+
+def _account_ledgers(ledger_path, account, owns_unsharded):
+    # every partition file of the account, and the unsharded ledger if its keys are the DEFAULT ones
+    root, ext = os.path.splitext(ledger_path)
+    pattern = re.compile(re.escape(f"{root}.{account}") + r'(\.\d+)?' + re.escape(ext) + r'\Z')
+    paths = sorted(path for path in glob.glob(f"{glob.escape(root)}.*{ext}") if pattern.match(path))
+    return ([ledger_path] if owns_unsharded else []) + paths
+
+
+def plan_workers(config_path=CONFIG_PATH, shards=None, account_names=None, status_interval_s=None):
+    # one spec per worker process: its pairs and the settings that differ from the account's
+    config = read_config(config_path)
+    default_access = config['DEFAULT'].get('access')
+    specs = []
+    for account in account_names or accounts(config):
+        base = BotConfig(config, account)
+        count = max(1, min(shards or base.shards, len(base.trade_pairs)))
+        unsharded = account == DEFAULT_ACCOUNT and count == 1
+        for index in range(count):
+            name = account if count == 1 else f"{account}.{index}"
+            overrides = {
+                'ledger_path': base.ledger_path if unsharded else _suffixed(base.ledger_path, name),
+                # the legacy csv belongs to the unsharded ledger, partitions get their rows moved over
+                'legacy_csv_path': base.legacy_csv_path if unsharded else None,
+                # all DCA pairs of an account run on its first worker, so the state file stays put
+                'dca_state_path': base.dca_state_path if account == DEFAULT_ACCOUNT
+                else _suffixed(base.dca_state_path, account),
+                # rate limits are per API key
+                'rest_max_requests_per_s': base.rest_max_requests_per_s / count,
+                'metrics_port': base.metrics_port + len(specs) if base.metrics_port else 0,
+                'account_shards': count,
+            }
+            if status_interval_s:
+                overrides['status_interval_s'] = status_interval_s
+            ledger_files = _account_ledgers(base.ledger_path, account, base.access == default_access)
+            # closed round trips stay where they were traded, replayed fills are checked against them
+            overrides['ledger_history_paths'] = [
+                path for path in ledger_files if os.path.abspath(path) != os.path.abspath(overrides['ledger_path'])]
+            specs.append({
+                'name': name,
+                'account': account,
+                'trade_pairs': base.trade_pairs[index::count],
+                'dca_pairs': base.dca_pairs if index == 0 else [],
+                'ledger_files': ledger_files,
+                'unsharded_csv': base.legacy_csv_path,
+                'overrides': overrides,
+            })
+    return specs
+
+
+def rebalance_ledgers(specs):
+    # move open buys into the partition of the worker trading their symbol, before any worker runs
+    logger = logging.getLogger(__name__)
+    for spec in specs:
+        target = spec['overrides']['ledger_path']
+        sources = [path for path in spec['ledger_files'] if os.path.abspath(path) != os.path.abspath(target)]
+        if not sources:
+            continue
+        unsharded = spec['ledger_files'][0]
+        if unsharded in sources and not os.path.isfile(unsharded) and os.path.isfile(spec['unsharded_csv']):
+            # the legacy csv was never migrated, do it now so its open buys can be handed out
+            TradeLedger(unsharded, csv_path=spec['unsharded_csv']).close()
+        ledger = TradeLedger(target)
+        try:
+            for source in sources:
+                moved = ledger.adopt_open_buys(source, spec['trade_pairs'])
+                if moved:
+                    logger.info(f"Moved {moved} open buys from {source} to {target}")
+        finally:
+            ledger.close()
+
+
+def run_worker(config_path, spec, status_queue):
+    # entry point of a worker process: one WebSocketClient on its partition, reporting its health
+    from hashkey_bot import WebSocketClient, open_ledger
+
+    # Ctrl-C reaches the whole process group, the supervisor stops workers with SIGTERM instead
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO,
+                        format=f"%(asctime)s {spec['name']} %(levelname)s %(name)s: %(message)s")
+    logger = logging.getLogger(__name__)
+    config = load_config(config_path, spec['account'], spec['trade_pairs'], spec['dca_pairs'],
+                         **spec['overrides'])
+    ledger = open_ledger(config)
+    client = WebSocketClient(config, ledger, ["depth"], config.trade_pairs)
+    stopped = threading.Event()
+
+    def report(final=False):
+        try:
+            status_queue.put({'worker': spec['name'], 'account': spec['account'], 'pid': os.getpid(),
+                              'pairs': config.trade_pairs, 'time': time.time(), 'stopped': final,
+                              **client.health()})
+        except Exception as e:
+            logger.error(f"Status report failed: {e}")
+
+    def report_loop():
+        while not stopped.wait(config.status_interval_s):
+            report()
+
+    def on_term(signum, frame):
+        if client._main_task is None:
+            raise SystemExit(0)
+        client.stop()
+
+    signal.signal(signal.SIGTERM, on_term)
+    threading.Thread(target=report_loop, name='status', daemon=True).start()
+    try:
+        client.connect()
+    finally:
+        stopped.set()
+        report(final=True)
+        ledger.close()
+
+
+class Supervisor:
+    # Starts one process per worker spec, collects their status reports and restarts workers that
+    # exit, with a backoff that resets once a worker has run for a while.
+    def __init__(self, config_path, specs, status_interval_s=30, restart_delay_s=5, max_restart_delay_s=300):
+        self.config_path = config_path
+        self.specs = {spec['name']: spec for spec in specs}
+        self.status_interval_s = status_interval_s
+        self.restart_delay_s = restart_delay_s
+        self.max_restart_delay_s = max_restart_delay_s
+        self.status = {}  # worker -> last report
+        self._context = multiprocessing.get_context('spawn')
+        self.status_queue = self._context.Queue()
+        self._processes = {}  # worker -> (Process, start time)
+        self._restarts = {}  # worker -> (consecutive restarts, monotonic time of the next start)
+        self._stopping = threading.Event()
+        self._logger = logging.getLogger(__name__)
+
+    def _start(self, name):
+        process = self._context.Process(target=run_worker, name=f"hashkey-{name}",
+                                        args=(self.config_path, self.specs[name], self.status_queue))
+        process.start()
+        self._processes[name] = (process, time.monotonic())
+        self._logger.info(f"Worker {name} started (pid {process.pid}): {', '.join(self.specs[name]['trade_pairs'])}")
+
+    def _check_workers(self):
+        now = time.monotonic()
+        for name, (process, started) in list(self._processes.items()):
+            if process.is_alive():
+                continue
+            restarts = 0 if now - started > 60 else self._restarts.get(name, (0, 0))[0] + 1
+            delay = min(self.max_restart_delay_s, self.restart_delay_s * 2 ** restarts)
+            self._logger.error(f"Worker {name} exited with {process.exitcode}, restarting in {delay:.0f}s")
+            self._restarts[name] = (restarts, now + delay)
+            del self._processes[name]
+        for name, (restarts, start_at) in list(self._restarts.items()):
+            if name not in self._processes and now >= start_at:
+                self._start(name)
+
+    def _drain(self, timeout):
+        try:
+            report = self.status_queue.get(timeout=timeout)
+            while True:
+                self.status[report['worker']] = report
+                report = self.status_queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def aggregate(self):
+        # totals over the latest report of every worker, per account and overall
+        now = time.time()
+        totals = {}
+        for name in self.specs:
+            report = self.status.get(name)
+            account = self.specs[name]['account']
+            for key in (account, 'all'):
+                total = totals.setdefault(key, {'workers': 0, 'connected': 0, 'stale': 0, 'fills': 0,
+                                                'orders_sent': 0, 'order_errors': 0, 'open': 0,
+                                                'open_cost': 0.0, 'realized': 0.0, 'closed': 0})
+                total['workers'] += 1
+                if report is None or now - report['time'] > 3 * self.status_interval_s:
+                    total['stale'] += 1
+                if report is None:
+                    continue
+                total['connected'] += report['connected']
+                for counter in ('fills', 'orders_sent', 'order_errors'):
+                    total[counter] += report['counters'].get(counter, 0)
+                for symbol_pnl in report['pnl'].values():
+                    for field in ('open', 'open_cost', 'realized', 'closed'):
+                        total[field] += symbol_pnl[field]
+        return totals
+
+    def log_status(self):
+        for name in self.specs:
+            report = self.status.get(name)
+            if report is None:
+                self._logger.info(f"Worker {name}: no report yet")
+                continue
+            pnl = report['pnl'].values()
+            self._logger.info(
+                f"Worker {name} pid {report['pid']} {'connected' if report['connected'] else 'DOWN'}, "
+                f"fills {report['counters'].get('fills', 0)}, orders {report['counters'].get('orders_sent', 0)}, "
+                f"errors {report['counters'].get('order_errors', 0)}, live buys {report['live_buys']}, "
+                f"queued {report['pipeline']['fills']['depth']}/{report['pipeline']['orders']['depth']}, "
+                f"open {sum(p['open'] for p in pnl)}, "
+                f"realized {sum(p['realized'] for p in pnl):.2f}")
+        for key, total in self.aggregate().items():
+            self._logger.info(f"Total {key}: {total}")
+
+    def run(self):
+        for name in self.specs:
+            self._start(name)
+        last_log = time.monotonic()
+        try:
+            while not self._stopping.is_set():
+                self._drain(timeout=1)
+                self._check_workers()
+                if time.monotonic() - last_log >= self.status_interval_s:
+                    last_log = time.monotonic()
+                    self.log_status()
+        finally:
+            self._shutdown()
+
+    def stop(self):
+        # thread and signal safe, run() returns once the workers have exited
+        self._stopping.set()
+
+    def _shutdown(self):
+        for process, _ in self._processes.values():
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + 15
+        for name, (process, _) in self._processes.items():
+            process.join(max(0.1, deadline - time.monotonic()))
+            if process.is_alive():
+                self._logger.error(f"Worker {name} did not stop, killing it")
+                process.kill()
+                process.join()
+        self._drain(timeout=0.1)
+        self._logger.info("All workers stopped")
+        self.log_status()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the HashKey bot as worker processes sharded by account and pair')
+    parser.add_argument('--config', default=CONFIG_PATH)
+    parser.add_argument('--shards', type=int, help="workers per account, overrides the config's shards")
+    parser.add_argument('--accounts', help='comma separated account names, all accounts by default')
+    parser.add_argument('--status-interval', type=float, help='seconds between worker status reports')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s supervisor %(levelname)s %(name)s: %(message)s')
+
+    specs = plan_workers(args.config, args.shards, args.accounts.split(',') if args.accounts else None,
+                         args.status_interval)
+    rebalance_ledgers(specs)
+    status_interval_s = args.status_interval or read_config(args.config)['DEFAULT'].getfloat('status_interval_s', 30)
+    supervisor = Supervisor(args.config, specs, status_interval_s=status_interval_s)
+    signal.signal(signal.SIGTERM, lambda signum, frame: supervisor.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: supervisor.stop())
+    supervisor.run()
+
+
+if __name__ == '__main__':
+    main()
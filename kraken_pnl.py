@@ -0,0 +1,102 @@
+import argparse
+import configparser
+import json
+
+from kraken_sync import (KrakenClient, KrakenTradeStore, download_export, ingest_export, request_export,
+                         sync_trades, wait_for_export)
+
+# Kraken trade history sync and reports. Importing the module does nothing, main() is the entry
+# point (also run by kraken-pnl.py).
+#
+#   python kraken_pnl.py
+#   python kraken_pnl.py --export
+
+CONFIG_PATH = './config/config_kraken.cfg'
+STORE_PATH = './reports/kraken_trades.db'
+EXPORT_PATH = './reports/myexport.zip'
+OPEN_ORDERS_PATH = './reports/data.json'
+# first trade time to consider when there is no watermark yet
+HISTORY_START = 1634199845
+
+
+def make_client(config_path=CONFIG_PATH):
+    config = configparser.ConfigParser()
+    config.read(config_path)
+    # Read Kraken API key and secret stored in environment variables
+    api_key = config['DEFAULT']['api']
+    api_sec = config['DEFAULT']['private_key']
+    return KrakenClient(api_key, api_sec)
+
+
+def export_trades(client, store, history_start=HISTORY_START, export_path=EXPORT_PATH):
+    ####################
+    # Request for report
+    ####################
+
+    id, export_end = request_export(client, store, history_start, description='my_trades_1')
+    print(id)
+
+    ############################
+    # Wait for report to finish, download and delete
+    ############################
+
+    print(wait_for_export(client, id))
+
+    # Download report and save it to 'myexport.zip', then load its trades into the store
+    # straight from the archive, no extracted copy
+    download_export(client, id, export_path)
+    print(f"Trades ingested from export: {ingest_export(store, export_path)} new")
+    # next export starts where this one ended
+    store.set_watermark('export', export_end)
+
+    # Delete report?
+    print(client.call('/0/private/RemoveExport', {
+        "id": id,
+        "type": "delete"
+    }))
+
+
+def save_open_orders(client, path=OPEN_ORDERS_PATH):
+    # Construct the request and print the result
+    open_orders = client.call('/0/private/OpenOrders', {
+        "docalcs": True
+    })
+
+    # print(open_orders)
+    with open(path, 'w') as f:
+        json.dump(open_orders['open'], f)
+    return open_orders['open']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Kraken trade history sync and reports')
+    parser.add_argument('--export', action='store_true',
+                        help='also request a CSV trades export covering the time since the last export')
+    parser.add_argument('--config', default=CONFIG_PATH)
+    parser.add_argument('--store', default=STORE_PATH)
+    args = parser.parse_args(argv)
+
+    client = make_client(args.config)
+    store = KrakenTradeStore(args.store)
+    try:
+        ##########################
+        # Incremental trade sync
+        ##########################
+
+        added, fetched = sync_trades(client, store, default_start=HISTORY_START)
+        print(f'Trades synced: {added} new of {fetched} fetched, {store.count()} stored')
+
+        if args.export:
+            export_trades(client, store)
+
+        #############
+        # Open Orders
+        #############
+
+        save_open_orders(client)
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
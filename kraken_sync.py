@@ -0,0 +1,220 @@
+import io
+import logging
+import random
+import sqlite3
+import threading
+import time
+import zipfile
+
+import requests
+
+from signing import KrakenSigner
+
+API_URL = "https://api.kraken.com"
+
+TRADE_COLUMNS = ['txid', 'ordertxid', 'postxid', 'pair', 'time', 'type', 'ordertype', 'price',
+                 'cost', 'fee', 'vol', 'margin', 'misc', 'ledgers']
+REAL_COLUMNS = {'time', 'price', 'cost', 'fee', 'vol', 'margin'}
+# fixed dtypes for the export csv, time is parsed separately (the export writes datetimes)
+EXPORT_DTYPES = {col: 'float64' if col in REAL_COLUMNS - {'time'} else 'str' for col in TRADE_COLUMNS}
+DOWNLOAD_CHUNK = 1 << 20
+
+
+class KrakenError(Exception):
+    pass
+
+
+class KrakenClient:
+    # Private Kraken REST calls on one keep-alive session, with strictly increasing nonces
+    # and a retry with backoff when the API counter is exhausted.
+    def __init__(self, api_key, api_sec, api_url=API_URL, timeout=30, max_retries=3):
+        self.api_key = api_key
+        self.api_url = api_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self._signer = KrakenSigner(api_sec)
+        self._session = requests.Session()
+        self._nonce_lock = threading.Lock()
+        self._last_nonce = 0
+        self._logger = logging.getLogger(__name__)
+
+    def _nonce(self):
+        with self._nonce_lock:
+            self._last_nonce = max(self._last_nonce + 1, int(1000 * time.time()))
+            return str(self._last_nonce)
+
+    def request(self, uri_path, data=None, stream=False):
+        # raw response, e.g. for downloads
+        data = dict(data or {}, nonce=self._nonce())
+        postdata, signature = self._signer.sign(uri_path, data)
+        headers = {
+            'API-Key': self.api_key,
+            'API-Sign': signature,
+            'Content-Type': 'application/x-www-form-urlencoded; charset=utf-8',
+        }
+        return self._session.post(self.api_url + uri_path, headers=headers, data=postdata,
+                                  timeout=self.timeout, stream=stream)
+
+    def public_call(self, uri_path, params=None):
+        # unsigned GET on the public API, e.g. /0/public/Ticker
+        res = self._session.get(self.api_url + uri_path, params=params, timeout=self.timeout).json()
+        if res.get('error'):
+            raise KrakenError(f"{uri_path}: {res['error']}")
+        return res['result']
+
+    def call(self, uri_path, data=None):
+        # decoded 'result', raising KrakenError on API errors
+        for attempt in range(self.max_retries + 1):
+            res = self.request(uri_path, data).json()
+            errors = res.get('error') or []
+            if not errors:
+                return res['result']
+            if attempt < self.max_retries and any('Rate limit' in e or 'EService:Busy' in e for e in errors):
+                delay = random.uniform(1, 3) * 2 ** attempt
+                self._logger.warning(f"{uri_path} {errors}, retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            raise KrakenError(f"{uri_path}: {errors}")
+
+
+class KrakenTradeStore:
+    # Local trade history keyed by txid, so overlapping fetches never create duplicates,
+    # plus named watermarks recording how far each sync has got.
+    def __init__(self, db_path):
+        self._conn = sqlite3.connect(db_path)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        columns = ', '.join(
+            f"{col} {'REAL' if col in REAL_COLUMNS else 'TEXT'}" for col in TRADE_COLUMNS[1:])
+        self._conn.execute(f'CREATE TABLE IF NOT EXISTS trades (txid TEXT PRIMARY KEY, {columns})')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_trades_time ON trades (time)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self._conn.commit()
+
+    def add_trades(self, trades):
+        # trades: iterable of dicts with TRADE_COLUMNS keys, returns the number of new rows
+        return self.add_rows([_column_value(trade.get(col)) for col in TRADE_COLUMNS] for trade in trades)
+
+    def add_rows(self, rows):
+        # rows: iterable of sequences in TRADE_COLUMNS order
+        before = self._conn.total_changes
+        self._conn.executemany(
+            f"INSERT OR IGNORE INTO trades ({', '.join(TRADE_COLUMNS)}) "
+            f"VALUES ({', '.join('?' * len(TRADE_COLUMNS))})", rows)
+        self._conn.commit()
+        return self._conn.total_changes - before
+
+    def count(self):
+        return self._conn.execute('SELECT COUNT(*) FROM trades').fetchone()[0]
+
+    def get_watermark(self, key, default=None):
+        row = self._conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return float(row[0]) if row else default
+
+    def set_watermark(self, key, value):
+        self._conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, str(value)))
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+
+def _column_value(value):
+    if isinstance(value, (list, dict)):
+        return ','.join(value) if isinstance(value, list) else str(value)
+    return value
+
+
+def sync_trades(client, store, overlap_s=60, default_start=None):
+    # Fetch trades newer than the stored watermark through TradesHistory pagination and merge
+    # them into the store. The window starts overlap_s before the watermark, trades landing on
+    # the boundary are caught and the txid key drops the ones we already have. Pages come newest
+    # first, so the watermark only moves once the whole window has been read.
+    watermark = store.get_watermark('trades_history', default_start)
+    params = {'end': int(time.time()), 'ofs': 0}
+    if watermark:
+        params['start'] = int(watermark - overlap_s)
+    added, fetched, latest = 0, 0, watermark
+    while True:
+        result = client.call('/0/private/TradesHistory', params)
+        page = [dict(trade, txid=txid) for txid, trade in result['trades'].items()]
+        if not page:
+            break
+        added += store.add_trades(page)
+        fetched += len(page)
+        latest = max([latest or 0] + [float(trade['time']) for trade in page])
+        params['ofs'] = fetched
+        if fetched >= int(result['count']):
+            break
+    if latest:
+        store.set_watermark('trades_history', latest)
+    return added, fetched
+
+
+def wait_for_export(client, export_id, report='trades', first_delay_s=2, max_delay_s=60, timeout_s=3600):
+    # poll ExportStatus with a growing delay until our report is processed
+    delay = first_delay_s
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        time.sleep(delay)
+        for export in client.call('/0/private/ExportStatus', {'report': report}):
+            if export.get('id') == export_id and export.get('status') == 'Processed':
+                return export
+        delay = min(max_delay_s, delay * 1.5)
+    raise KrakenError(f"export {export_id} not processed after {timeout_s}s")
+
+
+def download_export(client, export_id, target_path):
+    # stream RetrieveExport to disk in 1 MiB chunks
+    resp = client.request('/0/private/RetrieveExport', {"id": export_id}, stream=True)
+    resp.raise_for_status()
+    with open(target_path, 'wb') as handle:
+        for chunk in resp.iter_content(chunk_size=DOWNLOAD_CHUNK):
+            handle.write(chunk)
+    return target_path
+
+
+def ingest_export(store, zip_path, chunksize=100000):
+    # Parse the trades csv straight out of the export archive in fixed-dtype chunks and merge
+    # them into the store, memory stays bounded by the chunk size whatever the export size.
+    # pandas is only needed here, the sync and the API calls start without it.
+    import pandas as pd
+    added = 0
+    with zipfile.ZipFile(zip_path) as archive:
+        for name in archive.namelist():
+            if not name.endswith('.csv'):
+                continue
+            with io.BufferedReader(archive.open(name), buffer_size=DOWNLOAD_CHUNK) as f:
+                chunks = pd.read_csv(f, chunksize=chunksize, dtype=EXPORT_DTYPES,
+                                     usecols=lambda col: col in EXPORT_DTYPES)
+                for chunk in chunks:
+                    if 'txid' not in chunk:
+                        break  # not a trades report
+                    added += store.add_rows(_export_rows(chunk))
+    return added
+
+
+def _export_rows(chunk):
+    import pandas as pd
+    time_col = chunk['time'] if 'time' in chunk else pd.Series(index=chunk.index, dtype='str')
+    numeric_time = pd.to_numeric(time_col, errors='coerce')
+    if numeric_time.isna().any():
+        # '2021-10-14 08:24:05.1234' (UTC) -> unix seconds, the fraction width varies from row to row
+        times = pd.to_datetime(time_col, utc=True, format='ISO8601')
+        numeric_time = (times - pd.Timestamp(0, tz='UTC')) / pd.Timedelta(seconds=1)
+    chunk = chunk.reindex(columns=TRADE_COLUMNS).assign(time=numeric_time)
+    return chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None)
+
+
+def request_export(client, store, default_start, description='my_trades'):
+    # trades export covering everything since the end of the previous export,
+    # the window end is recorded as the new watermark once the report is retrieved
+    start = int(store.get_watermark('export', default_start))
+    end = int(time.time())
+    result = client.call('/0/private/AddExport', {
+        "description": description,
+        "format": "CSV",
+        "report": "trades",
+        "starttm": start,
+        "endtm": end,
+    })
+    return result['id'], end
@@ -0,0 +1,226 @@
+import numpy as np
+import pandas as pd
+
+# Fill level P&L. Works on a flat fill frame with FILL_COLUMNS:
+#   symbol, side ('buy'/'sell'), qty (base), price (quote), fee (quote), ts (unix seconds)
+# Every computation is a handful of array operations per symbol, no per-fill Python loop.
+
+FILL_COLUMNS = ['symbol', 'side', 'qty', 'price', 'fee', 'ts']
+# quantities below this are float leftovers of matching, not a position
+QTY_EPSILON = 1e-12
+# log range of one segment in _linear_recurrence, exp(+-SEGMENT_LOG) stays well inside float64
+SEGMENT_LOG = 300.0
+
+
+def prepare_fills(fills):
+    # numeric columns, categorical symbol/side (compact, and cheap to sort and group on),
+    # stable time order within each symbol. A frame already prepared is returned as is.
+    if fills.attrs.get('prepared'):
+        return fills
+    fills = fills[FILL_COLUMNS].copy()
+    for col in ('qty', 'price', 'fee', 'ts'):
+        fills[col] = pd.to_numeric(fills[col], errors='coerce')
+    fills['fee'] = fills['fee'].fillna(0.0)
+    fills['symbol'] = fills['symbol'].astype('category')
+    side = fills['side'].astype('category')
+    fills['side'] = side.cat.rename_categories([str(c).lower() for c in side.cat.categories])
+    fills = fills.dropna(subset=['qty', 'price', 'ts'])
+    fills = fills.sort_values(['symbol', 'ts'], kind='stable').reset_index(drop=True)
+    fills.attrs['prepared'] = True
+    return fills
+
+
+def _matched_quantities(fills):
+    # Position per fill as the signed cumulative quantity floored at zero, i.e. the cumsum minus
+    # its running minimum. Sells beyond the position (coins bought before the history starts)
+    # are not matched. Returns (position, previous position, quantity each sell closes).
+    is_buy = (fills['side'] == 'buy').to_numpy()
+    qty = fills['qty'].to_numpy()
+    symbol = fills['symbol'].cat.codes.to_numpy()
+    raw = pd.Series(np.where(is_buy, qty, -qty)).groupby(symbol, sort=False).cumsum()
+    floor = raw.groupby(symbol, sort=False).cummin().clip(upper=0.0)
+    position = (raw - floor).to_numpy(copy=True)
+    position[np.abs(position) < QTY_EPSILON] = 0.0
+    prev_position = pd.Series(position).groupby(symbol, sort=False).shift(1, fill_value=0.0).to_numpy()
+    return position, prev_position, np.where(is_buy, 0.0, prev_position - position)
+
+
+def fifo_match(fills):
+    # FIFO lots from cumulative quantities: the k-th unit sold is the k-th unit bought, so the
+    # union of the buy and sell cumulative-quantity breakpoints cuts the history into segments
+    # that each belong to exactly one buy and one sell, found with searchsorted.
+    # Only the part of each sell covered by the position is matched (see _matched_quantities),
+    # so every sell meets buys from before it.
+    # Returns (matches, open_lots, unmatched_sells), fees are allocated pro rata by quantity.
+    fills = prepare_fills(fills)
+    fills['matched'] = _matched_quantities(fills)[2]
+    matches, open_lots, unmatched = [], [], []
+    for symbol, group in fills.groupby('symbol', sort=False, observed=True):
+        buys = group[group['side'] == 'buy']
+        sells = group[group['side'] == 'sell']
+        unmatched_qty = (sells['qty'] - sells['matched']).sum()
+        sells = sells[sells['matched'] > 0]
+        buy_cum = buys['qty'].to_numpy().cumsum()
+        sell_cum = sells['matched'].to_numpy().cumsum()
+        total_buy = buy_cum[-1] if len(buy_cum) else 0.0
+        matched_qty = min(total_buy, sell_cum[-1] if len(sell_cum) else 0.0)
+
+        if matched_qty > 0:
+            points = np.unique(np.concatenate([buy_cum, sell_cum, [matched_qty]]))
+            points = points[points <= matched_qty]
+            seg_qty = np.diff(points, prepend=0.0)
+            keep = seg_qty > 0
+            points, seg_qty = points[keep], seg_qty[keep]
+            b = np.searchsorted(buy_cum, points, side='left')
+            s = np.searchsorted(sell_cum, points, side='left')
+            b_qty, b_price, b_fee, b_ts = (buys[col].to_numpy()[b] for col in ('qty', 'price', 'fee', 'ts'))
+            s_qty, s_price, s_fee, s_ts = (sells[col].to_numpy()[s] for col in ('qty', 'price', 'fee', 'ts'))
+            fees = seg_qty / b_qty * b_fee + seg_qty / s_qty * s_fee
+            matches.append(pd.DataFrame({
+                'symbol': symbol,
+                'qty': seg_qty,
+                'buy_price': b_price,
+                'sell_price': s_price,
+                'buy_ts': b_ts,
+                'sell_ts': s_ts,
+                'fees': fees,
+                'P_L': seg_qty * (s_price - b_price) - fees,
+                'holding_s': s_ts - b_ts,
+            }))
+
+        if total_buy - matched_qty > QTY_EPSILON:
+            # the tail of the buys beyond what was sold is still held
+            open_qty = np.minimum(buys['qty'].to_numpy(), np.maximum(buy_cum - matched_qty, 0.0))
+            held = open_qty > QTY_EPSILON
+            open_lots.append(pd.DataFrame({
+                'symbol': symbol,
+                'qty': open_qty[held],
+                'price': buys['price'].to_numpy()[held],
+                'fee': (open_qty / buys['qty'].to_numpy() * buys['fee'].to_numpy())[held],
+                'ts': buys['ts'].to_numpy()[held],
+            }))
+        if unmatched_qty > QTY_EPSILON:
+            unmatched.append({'symbol': symbol, 'qty': unmatched_qty})
+
+    return (_concat(matches, ['symbol', 'qty', 'buy_price', 'sell_price', 'buy_ts', 'sell_ts', 'fees',
+                              'P_L', 'holding_s']),
+            _concat(open_lots, ['symbol', 'qty', 'price', 'fee', 'ts']),
+            pd.DataFrame(unmatched, columns=['symbol', 'qty']))
+
+
+def _linear_recurrence(a, b, group):
+    # C[t] = a[t] * C[t-1] + b[t] inside each group (C starts from zero), for 0 < a <= 1. With
+    # L = cumsum(log a) the solution is C = exp(L) * cumsum(b * exp(-L)), but exp(-L) overflows
+    # once -L passes ~700, e.g. a long run of sells in one epoch. So the rows are cut into
+    # segments where -L grows by at most SEGMENT_LOG, each solved relative to the L just before
+    # it and seeded with the C its predecessor ended on; that carry is the only sequential step,
+    # one vectorized pass per segment rank rather than per row.
+    if not len(a):
+        return np.zeros(0)
+    log_l = pd.Series(np.log(a)).groupby(group).cumsum().to_numpy()
+    new_group = np.r_[True, group[1:] != group[:-1]]
+    level = np.floor(-log_l / SEGMENT_LOG)
+    new_segment = new_group | np.r_[False, level[1:] != level[:-1]]
+    segment = np.cumsum(new_segment) - 1
+    first = np.flatnonzero(new_segment)
+    last = np.r_[first[1:] - 1, len(a) - 1]
+    # L before the first row of each segment, zero at the start of a group
+    base = np.where(new_group[first], 0.0, log_l[np.maximum(first - 1, 0)])[segment]
+    scale = np.exp(log_l - base)
+    partial = scale * pd.Series(b * np.exp(base - log_l)).groupby(segment).cumsum().to_numpy()
+
+    # position of each segment within its group, the carries of rank k need those of rank k - 1
+    index = np.arange(len(first))
+    rank = index - np.maximum.accumulate(np.where(new_group[first], index, 0))
+    carry = np.zeros(len(first))
+    order = np.argsort(rank, kind='stable')
+    bounds = np.searchsorted(rank[order], np.arange(1, rank.max() + 2))
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        seg = order[lo:hi]
+        carry[seg] = scale[last[seg - 1]] * carry[seg - 1] + partial[last[seg - 1]]
+    return scale * carry[segment] + partial
+
+
+def average_cost(fills):
+    # Average-cost accounting over the floored position (see _matched_quantities). The cost
+    # basis follows the linear recurrence
+    #   C[t] = a[t] * C[t-1] + b[t],  a = 1, b = qty * price + fee for buys,
+    #                                 a = position[t] / position[t-1], b = 0 for sells,
+    # solved in closed form by _linear_recurrence inside each epoch, an epoch ending whenever
+    # the position goes flat (which is also where a would hit zero).
+    # Returns the fills with position, cost_basis, matched qty and realized P&L per fill.
+    fills = prepare_fills(fills)
+    is_buy = (fills['side'] == 'buy').to_numpy()
+    qty = fills['qty'].to_numpy()
+    price = fills['price'].to_numpy()
+    fee = fills['fee'].to_numpy()
+    symbol = fills['symbol'].cat.codes.to_numpy()
+    position, prev_position, matched = _matched_quantities(fills)
+
+    flat = position == 0.0
+    # a new epoch starts after every flat row and at every symbol change
+    new_symbol = np.r_[True, symbol[1:] != symbol[:-1]]
+    epoch = np.cumsum(new_symbol | np.r_[False, flat[:-1]])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a = np.where(is_buy | (prev_position == 0.0), 1.0, position / prev_position)
+    a[flat] = 1.0  # C is zero there anyway
+    b = np.where(is_buy, qty * price + fee, 0.0)
+    cost = _linear_recurrence(a, b, epoch)
+    cost[flat] = 0.0
+    prev_cost = pd.Series(cost).groupby(epoch).shift(1, fill_value=0.0).to_numpy()
+
+    realized = np.where(is_buy, 0.0, matched * price - fee * np.divide(
+        matched, qty, out=np.zeros_like(qty), where=qty > 0) - (prev_cost - cost))
+    return fills.assign(position=position, cost_basis=cost, matched_qty=matched,
+                        unmatched_qty=np.where(is_buy | (qty - matched < QTY_EPSILON), 0.0, qty - matched), P_L=realized)
+
+
+def mark_to_market(positions, prices):
+    # positions: frame with symbol, qty and cost (quote), prices: symbol -> latest price, e.g.
+    # best bids from the book cache. Symbols without a price are left unmarked (NaN).
+    marks = positions['symbol'].map(prices).astype(float)
+    return positions.assign(mark=marks, value=positions['qty'] * marks,
+                            unrealized=positions['qty'] * marks - positions['cost'])
+
+
+def fifo_positions(open_lots):
+    lots = open_lots.assign(cost=open_lots['qty'] * open_lots['price'] + open_lots['fee'])
+    return lots.groupby('symbol', as_index=False)[['qty', 'cost']].sum()
+
+
+def average_cost_positions(ledger):
+    # last position and cost basis per symbol from the output of average_cost
+    last = ledger.groupby('symbol', sort=False, observed=True).tail(1)
+    return pd.DataFrame({'symbol': last['symbol'].to_numpy(), 'qty': last['position'].to_numpy(),
+                         'cost': last['cost_basis'].to_numpy()})
+
+
+def summarise(fills, prices=None, method='fifo'):
+    # per symbol realized P&L, fees, holding period and (with prices) unrealized P&L
+    fills = prepare_fills(fills)
+    fees = fills.groupby('symbol', observed=True)['fee'].sum().rename('fees')
+    if method == 'fifo':
+        matches, open_lots, unmatched = fifo_match(fills)
+        realized = matches.groupby('symbol').agg(
+            realized=('P_L', 'sum'), matched_qty=('qty', 'sum'),
+            avg_holding_h=('holding_s', lambda s: np.average(s, weights=matches.loc[s.index, 'qty']) / 3600))
+        positions = fifo_positions(open_lots)
+        unmatched = unmatched.set_index('symbol')['qty'].rename('unmatched_qty')
+    elif method == 'average':
+        ledger = average_cost(fills)
+        realized = ledger.groupby('symbol', observed=True).agg(realized=('P_L', 'sum'), matched_qty=('matched_qty', 'sum'))
+        positions = average_cost_positions(ledger)
+        unmatched = ledger.groupby('symbol', observed=True)['unmatched_qty'].sum()
+    else:
+        raise ValueError(f"unknown lot matching method {method}")
+    positions = positions[positions['qty'] > QTY_EPSILON]
+    if prices is not None:
+        positions = mark_to_market(positions, prices)
+    summary = pd.concat([realized, fees, unmatched, positions.set_index('symbol')], axis=1)
+    summary.index.name = 'symbol'
+    return summary.reset_index()
+
+
+def _concat(frames, columns):
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
@@ -0,0 +1,266 @@
+import argparse
+import configparser
+import datetime
+import glob
+import logging
+import os
+import sqlite3
+import time
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import pnl
+
+# Combined P&L and exposure across exchanges. Every source is normalised into one compact fill
+# schema (pnl.FILL_COLUMNS plus exchange, strategy) and the normalised fills are kept in a
+# snapshot, so a re-run only reads ledger rows that are new or were still open last time.
+#
+#   python pnl_report.py                      # HashKey ledger + local Kraken store
+#   python pnl_report.py --sync --mark        # pull new Kraken trades and mark against live prices
+#   python pnl_report.py --method average --rebuild
+#
+# The HashKey ledger includes the partitions hashkey_supervisor workers write next to it.
+
+REPORT_COLUMNS = pnl.FILL_COLUMNS + ['exchange', 'strategy', 'source_row']
+HASHKEY_DB = './reports/trade_data.db'
+KRAKEN_DB = './reports/kraken_trades.db'
+SNAPSHOT = './reports/fills_snapshot.pkl'
+# ledger times are written with datetime.fromtimestamp, i.e. in the bot's local time
+LOCAL_TZ = datetime.datetime.now().astimezone().tzinfo
+KRAKEN_ASSETS = {'XBT': 'BTC', 'XDG': 'DOGE'}
+
+logger = logging.getLogger(__name__)
+
+
+def _connect_ro(db_path):
+    # read only, the bot keeps writing in WAL mode while the report runs
+    return sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+
+
+def _epoch_s(times, tz=None):
+    times = pd.to_datetime(times, errors='coerce')
+    if tz is not None:
+        times = times.dt.tz_localize(tz)
+        return (times - pd.Timestamp(0, tz='UTC')) / pd.Timedelta(seconds=1)
+    return (times - pd.Timestamp(0)) / pd.Timedelta(seconds=1)
+
+
+def _fills(symbol, side, qty, price, fee, ts, exchange, strategy, source_row):
+    return pd.DataFrame({'symbol': symbol, 'side': side, 'qty': pd.to_numeric(qty, errors='coerce'),
+                         'price': pd.to_numeric(price, errors='coerce'), 'fee': fee, 'ts': ts,
+                         'exchange': exchange, 'strategy': strategy, 'source_row': source_row})
+
+
+def normalise_hashkey(rows):
+    # one ledger row holds a buy and, once closed, its sell; orphaned sells have no buy side.
+    # Fees are converted to quote, the buy commission is charged in the base asset.
+    buy_price = pd.to_numeric(rows['Buy_Price'], errors='coerce')
+    bought = rows['Buy_ID'].notna()
+    sold = rows['Sell_ID'].notna()
+    buys = _fills(rows['Symbol'], 'buy', rows['Buy_Qty'], buy_price,
+                  pd.to_numeric(rows['Buy_Fee'], errors='coerce').fillna(0.0) * buy_price,
+                  _epoch_s(rows['Buy_Time'], LOCAL_TZ), 'hashkey', rows['Strategy'], rows['rowid'])[bought]
+    sells = _fills(rows['Symbol'], 'sell', rows['Sell_Qty'], rows['Sell_Price'],
+                   pd.to_numeric(rows['Sell_Fee'], errors='coerce').fillna(0.0),
+                   _epoch_s(rows['Sell_Time'], LOCAL_TZ), 'hashkey', rows['Strategy'], rows['rowid'])[sold]
+    return pd.concat([buys, sells], ignore_index=True)
+
+
+def kraken_symbol(pair):
+    # 'XXBTZUSD' -> 'BTCUSD', other pairs ('DOTUSD', 'XBTUSDT') keep their code
+    if len(pair) == 8 and pair[0] in 'XZ' and pair[4] in 'XZ':
+        base, quote = pair[1:4], pair[5:]
+        return KRAKEN_ASSETS.get(base, base) + KRAKEN_ASSETS.get(quote, quote)
+    return KRAKEN_ASSETS.get(pair[:3], pair[:3]) + pair[3:] if pair[:3] in KRAKEN_ASSETS else pair
+
+
+def normalise_kraken(rows):
+    # Kraken fees are charged in the quote currency
+    symbols = rows['pair'].map(kraken_symbol)
+    strategy = np.where(rows['ordertype'] == 'market', 'DCA', rows['ordertype'].fillna('kraken'))
+    return _fills(symbols, rows['type'], rows['vol'], rows['price'],
+                  pd.to_numeric(rows['fee'], errors='coerce').fillna(0.0),
+                  pd.to_numeric(rows['time'], errors='coerce'), 'kraken', strategy, rows['rowid'])
+
+
+def _compact(fills):
+    fills = fills[REPORT_COLUMNS].reset_index(drop=True)
+    for col in ('symbol', 'side', 'exchange', 'strategy'):
+        fills[col] = fills[col].astype(str).astype('category')
+    return fills
+
+
+def hashkey_ledgers(db_path):
+    # the ledger and its worker partitions, e.g. trade_data.main.0.db
+    root, ext = os.path.splitext(db_path)
+    return [db_path] + sorted(glob.glob(f"{glob.escape(root)}.*{ext}"))
+
+
+def load_hashkey(db_path, cached):
+    # Rows are inserted on buy fills and updated in place when the sell fills, so besides the
+    # rows added since the last run the rows that were still open are read again. Open rows may
+    # also have been moved to another partition, their cached fills are dropped either way.
+    if not os.path.isfile(db_path):
+        return None
+    with closing(_connect_ro(db_path)) as conn:
+        last = cached['last_rowid'] if cached else 0
+        if last > (conn.execute('SELECT MAX(rowid) FROM trades').fetchone()[0] or 0):
+            cached, last = None, 0  # ledger was rebuilt
+        open_rows = cached['open_rowids'] if cached else []
+        rows = pd.read_sql_query(
+            'SELECT rowid, * FROM trades WHERE rowid > ? OR rowid IN (SELECT value FROM json_each(?))',
+            conn, params=(last, pd.Series(open_rows, dtype='int64').to_json(orient='values')))
+    rows['Buy_ID'] = rows['Buy_ID'].replace('', None)
+    rows['Sell_ID'] = rows['Sell_ID'].replace('', None)
+    fresh = normalise_hashkey(rows)
+    fills = fresh if not cached else pd.concat(
+        [cached['fills'][~cached['fills']['source_row'].isin(open_rows)], fresh], ignore_index=True)
+    still_open = rows.loc[rows['Buy_ID'].notna() & rows['Sell_ID'].isna(), 'rowid']
+    return {'fills': _compact(fills), 'last_rowid': int(max(last, rows['rowid'].max() if len(rows) else 0)),
+            'open_rowids': still_open.astype(int).tolist(), 'read_rows': len(rows)}
+
+
+def load_kraken(db_path, cached, sync_config=None):
+    # txid-keyed and append only, only rows beyond the last rowid are new
+    if sync_config:
+        from kraken_sync import KrakenTradeStore, sync_trades
+        store = KrakenTradeStore(db_path)
+        try:
+            added, fetched = sync_trades(_kraken_client(sync_config), store,
+                                         default_start=sync_config.getint('history_start', 1634199845))
+            logger.info(f"Kraken sync: {added} new of {fetched} fetched")
+        finally:
+            store.close()
+    if not os.path.isfile(db_path):
+        return None
+    with closing(_connect_ro(db_path)) as conn:
+        last = cached['last_rowid'] if cached else 0
+        if last > (conn.execute('SELECT MAX(rowid) FROM trades').fetchone()[0] or 0):
+            cached, last = None, 0
+        rows = pd.read_sql_query('SELECT rowid, * FROM trades WHERE rowid > ?', conn, params=(last,))
+    fresh = normalise_kraken(rows)
+    fills = fresh if not cached else pd.concat([cached['fills'], fresh], ignore_index=True)
+    return {'fills': _compact(fills), 'last_rowid': int(max(last, rows['rowid'].max() if len(rows) else 0)),
+            'read_rows': len(rows)}
+
+
+def _kraken_client(config):
+    from kraken_sync import KrakenClient
+    return KrakenClient(config['api'], config['private_key'])
+
+
+def hashkey_prices(rest_url=None):
+    # best bids from the public book ticker
+    from hashkey_rest import BASE_URL, HashKeyRestClient
+    rest = HashKeyRestClient('', '', base_url=rest_url or BASE_URL)
+    try:
+        return {t['s']: float(t['b']) for t in rest.public_request('GET', '/quote/v1/ticker/bookTicker').json()}
+    finally:
+        rest.close()
+
+
+def kraken_prices(pairs):
+    # best bids from the public ticker, no credentials needed
+    from kraken_sync import KrakenClient
+    result = KrakenClient('', '').public_call('/0/public/Ticker', {'pair': ','.join(pairs)}) if pairs else {}
+    return {kraken_symbol(pair): float(ticker['b'][0]) for pair, ticker in result.items()}
+
+
+def load_snapshot(path):
+    try:
+        return pd.read_pickle(path)
+    except (FileNotFoundError, EOFError):
+        return {}
+
+
+def save_snapshot(path, snapshot):
+    tmp = path + '.tmp'
+    pd.to_pickle(snapshot, tmp)
+    os.replace(tmp, path)
+
+
+def build_report(fills, prices, method):
+    # realized/unrealized per exchange and symbol, exposure per symbol across exchanges
+    parts = []
+    for exchange, group in fills.groupby('exchange', observed=True):
+        marks = {s: p for (ex, s), p in prices.items() if ex == exchange} if prices else None
+        if marks is not None:
+            # unpriced symbols fall back to the last fill price
+            last = group.sort_values('ts').groupby('symbol', observed=True)['price'].last()
+            marks = dict(last.to_dict(), **marks)
+        summary = pnl.summarise(group, marks, method=method)
+        parts.append(summary.assign(exchange=exchange))
+    report = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+    exposure = None
+    if 'value' in report:
+        exposure = report.groupby('symbol')[['qty', 'cost', 'value', 'unrealized']].sum(min_count=1)
+    return report, exposure
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Combined HashKey and Kraken P&L report')
+    parser.add_argument('--hashkey-db', default=HASHKEY_DB, help='HashKey ledger, its partitions are read too')
+    parser.add_argument('--kraken-db', default=KRAKEN_DB)
+    parser.add_argument('--snapshot', default=SNAPSHOT, help='normalised fill cache')
+    parser.add_argument('--rebuild', action='store_true', help='ignore the snapshot and re-read every source')
+    parser.add_argument('--sync', action='store_true', help='pull new Kraken trades before reporting')
+    parser.add_argument('--mark', action='store_true', help='mark open positions against live prices')
+    parser.add_argument('--method', choices=['fifo', 'average'], default='fifo')
+    parser.add_argument('--output', default='./reports/pnl_report.csv')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    kraken_config = None
+    if args.sync:
+        config = configparser.ConfigParser()
+        config.read('./config/config_kraken.cfg')
+        kraken_config = config['DEFAULT']
+
+    snapshot = {} if args.rebuild else load_snapshot(args.snapshot)
+    start = time.perf_counter()
+    # each exchange is read (and synced) on its own thread, sqlite and the HTTP calls release the GIL
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        sources = {f"hashkey:{path}": pool.submit(load_hashkey, path, snapshot.get(f"hashkey:{path}"))
+                   for path in hashkey_ledgers(args.hashkey_db)}
+        sources['kraken'] = pool.submit(load_kraken, args.kraken_db, snapshot.get('kraken'), kraken_config)
+        snapshot = {name: future.result() for name, future in sources.items() if future.result() is not None}
+        prices = {}
+        if args.mark:
+            kraken_pairs = []
+            if 'kraken' in snapshot:
+                with closing(_connect_ro(args.kraken_db)) as conn:
+                    kraken_pairs = [r[0] for r in conn.execute('SELECT DISTINCT pair FROM trades')]
+            fetches = {'hashkey': pool.submit(hashkey_prices), 'kraken': pool.submit(kraken_prices, kraken_pairs)}
+            for exchange, future in fetches.items():
+                try:
+                    prices.update({(exchange, s): p for s, p in future.result().items()})
+                except Exception as e:
+                    logger.error(f"{exchange} prices unavailable: {e}")
+    load_s = time.perf_counter() - start
+    save_snapshot(args.snapshot, snapshot)
+
+    for name, source in snapshot.items():
+        logger.info(f"{name}: {source['read_rows']} ledger rows read, {len(source['fills'])} fills")
+    if not snapshot:
+        print('No ledger data found')
+        return
+    fills = pd.concat([source['fills'] for source in snapshot.values()], ignore_index=True)
+    report, exposure = build_report(fills, prices, args.method)
+
+    pd.set_option('display.width', 200)
+    pd.set_option('display.max_columns', 20)
+    print(report.to_string(index=False))
+    if exposure is not None:
+        print('\nExposure')
+        print(exposure.to_string())
+    print(f"\nRealized {report['realized'].sum():.2f}, fees {report['fees'].sum():.2f}"
+          + (f", unrealized {report['unrealized'].sum():.2f}" if 'unrealized' in report else '')
+          + f" ({len(fills)} fills, loaded in {load_s:.2f}s)")
+    report.to_csv(args.output, index=False)
+
+
+if __name__ == '__main__':
+    main()
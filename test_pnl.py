@@ -0,0 +1,110 @@
+from collections import deque
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import pnl
+
+# The vectorized P&L against straightforward per-fill loops.
+
+
+def reference_average_cost(fills):
+    # realized P&L per fill and the final (position, cost) per symbol
+    realized, state = [], {}
+    for row in fills.itertuples(index=False):
+        position, cost = state.get(row.symbol, (0.0, 0.0))
+        if row.side == 'buy':
+            position, cost = position + row.qty, cost + row.qty * row.price + row.fee
+            realized.append(0.0)
+        else:
+            matched = min(row.qty, position)
+            released = cost * matched / position if position > 0 else 0.0
+            realized.append(matched * row.price - row.fee * matched / row.qty - released)
+            position, cost = position - matched, cost - released
+            if position < 1e-12:
+                position, cost = 0.0, 0.0
+        state[row.symbol] = (position, cost)
+    return np.array(realized), state
+
+
+def reference_fifo(fills):
+    # realized P&L and open quantity per symbol
+    realized, held = {}, {}
+    for row in fills.itertuples(index=False):
+        lots = held.setdefault(row.symbol, deque())
+        if row.side == 'buy':
+            lots.append([row.qty, row.price, row.fee / row.qty])
+            continue
+        remaining = row.qty
+        while remaining > 1e-12 and lots:
+            lot = lots[0]
+            qty = min(remaining, lot[0])
+            realized[row.symbol] = realized.get(row.symbol, 0.0) + qty * (
+                row.price - lot[1] - lot[2] - row.fee / row.qty)
+            lot[0] -= qty
+            remaining -= qty
+            if lot[0] <= 1e-12:
+                lots.popleft()
+    return realized, {symbol: sum(lot[0] for lot in lots) for symbol, lots in held.items()}
+
+
+def random_fills(seed, n=2000, symbols=('BTCUSDT', 'ETHUSDT', 'XRPUSDT')):
+    rng = np.random.default_rng(seed)
+    fills = pd.DataFrame({
+        'symbol': rng.choice(symbols, n),
+        # sells slightly more likely, so positions regularly go flat and sells overshoot them
+        'side': np.where(rng.random(n) < 0.45, 'buy', 'sell'),
+        'qty': rng.integers(1, 20, n) / 4,
+        'price': 100 + rng.normal(0, 5, n).cumsum() / 10,
+        'fee': rng.random(n) / 10,
+        'ts': np.arange(n, dtype=float),
+    })
+    return pnl.prepare_fills(fills)
+
+
+def long_epoch_fills(pairs=5000):
+    # one buy held throughout, then buy/sell pairs that never take the position flat: every
+    # sell scales the cost basis by about a half, 5000 of them in a single epoch
+    rows = [('BTCUSDT', 'buy', 1.0, 100.0, 0.0, 0)]
+    for i in range(pairs):
+        rows += [('BTCUSDT', 'buy', 1.0, 100.0 + i % 7, 0.1, 2 * i + 1),
+                 ('BTCUSDT', 'sell', 1.0, 101.0 + i % 5, 0.1, 2 * i + 2)]
+    return pnl.prepare_fills(pd.DataFrame(rows, columns=pnl.FILL_COLUMNS))
+
+
+@pytest.mark.parametrize('fills', [random_fills(seed) for seed in range(3)] + [long_epoch_fills()])
+def test_average_cost_matches_loop(fills):
+    ledger = pnl.average_cost(fills)
+    realized, state = reference_average_cost(fills)
+    assert not ledger['P_L'].isna().any()
+    np.testing.assert_allclose(ledger['P_L'].to_numpy(), realized, rtol=1e-9, atol=1e-6)
+    positions = pnl.average_cost_positions(ledger).set_index('symbol')
+    for symbol, (position, cost) in state.items():
+        assert positions.loc[symbol, 'qty'] == pytest.approx(position, abs=1e-9)
+        assert positions.loc[symbol, 'cost'] == pytest.approx(cost, rel=1e-9, abs=1e-6)
+
+
+@pytest.mark.parametrize('fills', [random_fills(seed) for seed in range(3)] + [long_epoch_fills()])
+def test_fifo_matches_loop(fills):
+    matches, open_lots, _ = pnl.fifo_match(fills)
+    realized, held = reference_fifo(fills)
+    by_symbol = matches.groupby('symbol')['P_L'].sum()
+    for symbol, value in realized.items():
+        assert by_symbol[symbol] == pytest.approx(value, rel=1e-9, abs=1e-6)
+    open_qty = open_lots.groupby('symbol')['qty'].sum()
+    for symbol, qty in held.items():
+        assert open_qty.get(symbol, 0.0) == pytest.approx(qty, abs=1e-9)
+
+
+
+def test_fifo_leaves_no_dust_lots():
+    # lots summing to exactly the sold quantity in decimal leave float leftovers of ~1e-19
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        qty = np.round(rng.random(5) / 1000, 6)
+        rows = [('BTCUSDT', 'buy', q, 100.0, 0.01, i) for i, q in enumerate(qty)]
+        rows.append(('BTCUSDT', 'sell', float(qty.sum()), 101.0, 0.01, len(qty)))
+        fills = pd.DataFrame(rows, columns=pnl.FILL_COLUMNS)
+        assert pnl.fifo_match(fills)[1].empty
+        assert pnl.summarise(fills, prices={'BTCUSDT': 100.0})['qty'].isna().all()